@@ -1,5 +1,10 @@
+import os
 import sys
-from src.analyzer_gui import VideoStreamAnalyzerApp
+
+# Модули в src импортируют друг друга напрямую, как при запуске из src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+
+from analyzer_gui import VideoStreamAnalyzerApp
 from PyQt5.QtWidgets import QApplication
 
 if __name__ == "__main__":
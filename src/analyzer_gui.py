@@ -11,226 +11,247 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QH
                              QGroupBox, QSlider, QCheckBox, QFileDialog, QStatusBar)
 from PyQt5.QtCore import Qt, QTimer, pyqtSignal, QThread
 from PyQt5.QtGui import QImage, QPixmap
+from frame_source import ScreenFrameSource
+from capture_pipeline import FramePipeline
+from engine import DetectionEngine
+from report_writer import IncidentWriter, ImageEncoder, IMAGE_FORMATS, read_index
+from events import EventAggregator
+from report_store import FrameMetrics, clock_anchor, write_manifest
+from clip_buffer import ClipRecorder
+from histogram import format_summary, summary_lines
+from profiler import draw_overlay, write_profile
 
 class ScreenAnalyzerThread(QThread):
     update_signal = pyqtSignal(object)
     report_signal = pyqtSignal(str, object)
+    save_progress_signal = pyqtSignal(int, int)
     
-    def __init__(self, settings):
+    def __init__(self, settings, output_dir="reports"):
         super().__init__()
         self.settings = settings
+        self.output_dir = output_dir
         self.running = False
-        self.frame_buffer = []
-        self.report = []
+        self.pipeline = None
+        self.writer = None
+        self.report_dir = None
+        self.report_timestamp = None
+        self.clips = None
+        self.latency_time = 0.0
+        self.latency_summary = {}
+        self.start_time = None
+        # Превью: размер QLabel задает GUI, кадр уменьшается здесь в заранее
+        # выделенный RGB-буфер; пока GUI не показал кадр, новые пропускаются
+        self.preview_size = (640, 480)
+        self.preview_bgr = None
+        self.preview_rgb = None
+        self.preview_time = 0.0
+        self.preview_pending = False
+        self.preview_dropped = 0
+        self.preview_labels = set()
+        self.preview_lock = threading.Lock()
+        self.labels_lock = threading.Lock()
+        self.engine = DetectionEngine(settings['fps'], report_limit=settings['report_memory_limit'],
+                                      aggregator=EventAggregator())
+        self.report = self.engine.report
         
     def run(self):
         self.running = True
-        self.frame_buffer = []
-        self.report = []
         
-        buffer_size = 3
+        # Инциденты пишутся на диск по ходу анализа, в памяти только последние
+        self.report_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.report_dir = os.path.join(self.output_dir, f"report_{self.report_timestamp}")
+        encoder = ImageEncoder(self.settings['image_format'], self.settings['image_quality'],
+                               self.settings['thumbnail_width'], latency=self.engine.latency)
+        self.writer = IncidentWriter(self.report_dir, queue_size=self.settings['report_queue_size'],
+                                     policy=self.settings['report_policy'], encoder=encoder,
+                                     progress=self.save_progress_signal.emit).start()
+        self.engine.writer = self.writer
+        self.engine.metrics = FrameMetrics(self.report_dir, [d.name for d in self.engine.detectors])
+        # Время кадров - perf_counter, привязка к настенным часам пишется сразу,
+        # чтобы она осталась и после аварийного завершения
+        self.clock = clock_anchor()
+        write_manifest(self.report_dir, complete=False, started=self.report_timestamp, source="screen",
+                       clock=self.clock)
+        self.clips = None
+        if self.settings['record_clips']:
+            # Кадры для роликов уменьшаются и кодируются не в потоке захвата
+            self.clips = ClipRecorder(self.report_dir, self.settings['fps'], *self.settings['clip_seconds'],
+                                      scale=self.settings['clip_scale'])
+        self.engine.reset()
+        self.report = self.engine.report
+        self.start_time = time.perf_counter()
         
         try:
             while self.running:
-                loop_start = time.time()
+                # Захват и анализ идут в отдельных потоках, здесь только следим
+                # за сменой области и настроек (пороги меняются на лету)
+                self.engine.apply_settings(self.settings)
+                region = tuple(self.settings['region'])
+                if self.pipeline is None or self.pipeline.capture.source.region != region:
+                    start = 0
+                    if self.pipeline is not None:
+                        # События и ролик старой области закрываются, номера
+                        # кадров продолжаются, чтобы не смешать две области
+                        self.pipeline.stop()
+                        start = self.pipeline.ring.count
+                        self.engine.finish()
+                        if self.clips is not None:
+                            self.clips.restart()
+                    self.pipeline = FramePipeline(ScreenFrameSource(region), self.process_frame,
+                                                  self.settings['fps'],
+                                                  queue_size=self.settings['queue_size'],
+                                                  workers=self.settings['detection_workers'],
+                                                  gap_threshold=self.settings['frame_drop_threshold'],
+                                                  history=self.settings['buffer_size'],
+                                                  policy=self.settings['schedule_policy'],
+                                                  latency=self.engine.latency, start=start)
+                    self.pipeline.start()
                 
-                # Захват экрана
-                x1, y1, x2, y2 = self.settings['region']
-                screenshot = pyautogui.screenshot(region=(x1, y1, x2-x1, y2-y1))
-                frame = np.array(screenshot)
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-                
-                # Добавляем в буфер с отметкой времени
-                current_time = time.time()
-                self.frame_buffer.append({
-                    "frame": frame.copy(),
-                    "time": current_time
-                })
-                
-                # Ограничиваем размер буфера
-                if len(self.frame_buffer) > buffer_size:
-                    self.frame_buffer.pop(0)
-                
-                # Анализ дефектов если включено
-                analysis_results = []
-                
-                # 1. Обнаружение зеленых пикселей
-                if self.settings['detect_green']:
-                    green_detected = self.detect_green_pixels(frame)
-                    if green_detected:
-                        analysis_results.append("Green pixels")
-                
-                # 2. Обнаружение выпадения кадров
-                if self.settings['detect_frame_drops'] and len(self.frame_buffer) >= 2:
-                    frame_drop_detected = self.detect_frame_drops()
-                    if frame_drop_detected:
-                        analysis_results.append("Frame drop")
-                
-                # 3. Обнаружение разрывов изображения
-                if self.settings['detect_tearing'] and len(self.frame_buffer) >= 2:
-                    tearing_detected = self.detect_image_tearing(frame)
-                    if tearing_detected:
-                        analysis_results.append("Image tearing")
-                
-                # Отправляем текущий кадр в GUI
-                frame_data = {
-                    "frame": frame,
-                    "analysis": analysis_results
-                }
-                self.update_signal.emit(frame_data)
-                
-                # Расчет времени сна для поддержания FPS
-                fps = self.settings['fps']
-                process_time = time.time() - loop_start
-                sleep_time = (1.0 / fps) - process_time
-                
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
+                self.pipeline.capture.fps = self.settings['fps']
+                self.pipeline.capture.gap_threshold = self.settings['frame_drop_threshold']
+                time.sleep(0.05)
                     
         except Exception as e:
             print(f"Error in analyzer thread: {str(e)}")
+        finally:
+            if self.pipeline is not None:
+                self.pipeline.stop()
+            self.engine.finish()
+            self.writer.close()
+            self.engine.metrics.close()
+            if self.clips is not None:
+                self.clips.close()
+            # Разбивка времени по стадиям за всю сессию
+            write_profile(self.report_dir, self.engine.latency.summary(),
+                          time.perf_counter() - self.start_time)
+            # Машиночитаемая сводка для поиска событий по многим отчетам
+            write_manifest(self.report_dir, started=self.report_timestamp, source="screen",
+                           clock=self.clock, fps=self.settings['fps'], roi=tuple(self.settings['region']),
+                           frames=self.engine.metrics.frames, events=self.engine.event_count,
+                           clips=self.clips.written if self.clips is not None else 0,
+                           latency=self.engine.latency.summary())
         
         self.running = False
     
-    def detect_green_pixels(self, frame):
-        # Конвертация в HSV для лучшего обнаружения цвета
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        
-        # Диапазон зеленого цвета в HSV
-        lower_green = np.array([35, 100, 100])
-        upper_green = np.array([85, 255, 255])
-        
-        # Маска для выделения зеленого цвета
-        mask = cv2.inRange(hsv, lower_green, upper_green)
+    def process_frame(self, item):
+        # Вызывается потоками детекторов для каждого кадра из очереди
+        incidents = self.engine.process(item["context"])
+        if self.clips is not None:
+            self.clips.add(item["index"], item["time"], item["frame"])
+            for incident in incidents:
+                self.clips.trigger(incident)
+        for incident in incidents:
+            # Отправляем сигнал о найденном дефекте
+            self.report_signal.emit(incident["message"], incident["frame"])
         
-        # Подсчет зеленых пикселей
-        green_pixel_count = cv2.countNonZero(mask)
+        # Дефекты пропущенных для превью кадров попадают в статус следующего
+        if incidents:
+            with self.labels_lock:
+                self.preview_labels.update(incident["label"] for incident in incidents)
         
-        # Если зеленых пикселей больше порога
-        threshold = self.settings['green_threshold']
-        if green_pixel_count > threshold:
-            frame_with_mask = frame.copy()
-            green_areas = cv2.bitwise_and(frame_with_mask, frame_with_mask, mask=mask)
-            
-            # Добавляем области зеленого цвета на копию кадра
-            alpha = 0.5
-            cv2.addWeighted(green_areas, alpha, frame_with_mask, 1 - alpha, 0, frame_with_mask)
+        # Превью готовит один поток, остальные в это время его не ждут
+        if not self.preview_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if now - self.preview_time < 1.0 / self.settings['preview_fps']:
+                return
+            if self.preview_pending:
+                # GUI не успевает: пропускаем кадр, а не копим очередь сигналов
+                self.preview_dropped += 1
+                return
+            self.preview_time = now
             
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.report.append({
-                "timestamp": timestamp,
-                "type": "green_pixels",
-                "details": f"Detected {green_pixel_count} green pixels",
-                "frame": frame_with_mask.copy()
-            })
+            # Перцентили считаются по всей гистограмме, поэтому не чаще двух раз в секунду
+            latency = None
+            if now - self.latency_time >= 0.5:
+                self.latency_time = now
+                latency = self.latency_summary = self.engine.latency.summary()
             
-            # Отправляем сигнал о найденном дефекте
-            self.report_signal.emit(f"Green pixels: {green_pixel_count}", frame_with_mask)
-            return True
-        return False
+            with self.engine.latency.stage("preview.emit"):
+                frame = self.make_preview(item["frame"])
+                with self.labels_lock:
+                    labels, self.preview_labels = self.preview_labels, set()
+                stats = self.pipeline.stats()
+                stats["preview_dropped"] = self.preview_dropped
+                
+                # Отправляем текущий кадр в GUI
+                frame_data = {
+                    "frame": frame,
+                    "analysis": sorted(labels),
+                    "stats": stats,
+                    "latency": latency
+                }
+                self.preview_pending = True
+                self.update_signal.emit(frame_data)
+        finally:
+            self.preview_lock.release()
     
-    def detect_frame_drops(self):
-        # Проверяем интервал между кадрами
-        expected_interval = 1.0 / self.settings['fps']
-        actual_interval = self.frame_buffer[-1]["time"] - self.frame_buffer[-2]["time"]
-        
-        # Порог определения пропуска кадров (коэффициент)
-        threshold = self.settings['frame_drop_threshold']
-        
-        if actual_interval > (expected_interval * threshold):
-            frame_with_text = self.frame_buffer[-1]["frame"].copy()
-            text = f"Drop: {actual_interval:.4f}s vs expected {expected_interval:.4f}s"
-            cv2.putText(frame_with_text, text, (30, 60), cv2.FONT_HERSHEY_SIMPLEX, 
-                       0.8, (0, 0, 255), 2)
-            
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.report.append({
-                "timestamp": timestamp,
-                "type": "frame_drop",
-                "details": f"Expected: {expected_interval:.4f}s, Actual: {actual_interval:.4f}s",
-                "frame": frame_with_text.copy()
-            })
-            
-            # Отправляем сигнал о найденном дефекте
-            self.report_signal.emit(f"Frame drop: {actual_interval:.4f}s", frame_with_text)
-            return True
-        return False
+    def make_preview(self, frame):
+        # Уменьшаем кадр до размера QLabel с сохранением пропорций, буферы
+        # выделяются заново только при смене размера
+        height, width = frame.shape[:2]
+        label_width, label_height = self.preview_size
+        scale = min(label_width / width, label_height / height, 1.0)
+        size = (max(int(width * scale), 1), max(int(height * scale), 1))
+        if self.preview_rgb is None or self.preview_rgb.shape[1::-1] != size:
+            self.preview_bgr = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.preview_rgb = np.empty_like(self.preview_bgr)
+        cv2.resize(frame, size, dst=self.preview_bgr, interpolation=cv2.INTER_AREA)
+        if self.settings['profile_overlay']:
+            draw_overlay(self.preview_bgr, self.latency_summary)
+        cv2.cvtColor(self.preview_bgr, cv2.COLOR_BGR2RGB, dst=self.preview_rgb)
+        return self.preview_rgb
     
-    def detect_image_tearing(self, frame):
-        # Получаем предыдущий кадр из буфера
-        prev_frame = self.frame_buffer[-2]["frame"]
-        
-        # Конвертация в оттенки серого
-        gray1 = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Вычисляем разницу между кадрами
-        diff = cv2.absdiff(gray1, gray2)
-        
-        # Пороговая обработка разницы
-        threshold_value = self.settings['tearing_threshold']
-        _, thresh = cv2.threshold(diff, threshold_value, 255, cv2.THRESH_BINARY)
-        
-        # Находим контуры на изображении разницы
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Фильтруем контуры по размеру
-        min_contour_area = self.settings['tearing_min_area']
-        large_contours = [c for c in contours if cv2.contourArea(c) > min_contour_area]
-        
-        if len(large_contours) > 0:
-            # Рисуем контуры на копии кадра
-            frame_with_contours = frame.copy()
-            cv2.drawContours(frame_with_contours, large_contours, -1, (0, 0, 255), 2)
-            
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.report.append({
-                "timestamp": timestamp,
-                "type": "image_tearing",
-                "details": f"Detected {len(large_contours)} potential tears",
-                "frame": frame_with_contours.copy()
-            })
-            
-            # Отправляем сигнал о найденном дефекте
-            self.report_signal.emit(f"Image tearing: {len(large_contours)} areas", frame_with_contours)
-            return True
-        return False
+    def preview_shown(self):
+        # GUI скопировал кадр в QPixmap, буфер можно заполнять снова
+        self.preview_pending = False
     
     def stop(self):
         self.running = False
         self.wait()
     
-    def save_report(self, output_dir):
-        # Сохраняем отчет в файл
-        if not self.report:
+    def save_report(self):
+        # Кадры инцидентов уже на диске, дописываем сводку по индексу
+        records = read_index(self.report_dir) if self.report_dir else []
+        if not records:
             return "No issues to report"
         
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        report_dir = os.path.join(output_dir, f"report_{timestamp}")
-        os.makedirs(report_dir, exist_ok=True)
-        
-        with open(os.path.join(report_dir, "summary.txt"), "w") as f:
-            f.write(f"Screen Analysis Report - {timestamp}\n")
+        with open(os.path.join(self.report_dir, "summary.txt"), "w") as f:
+            f.write(f"Screen Analysis Report - {self.report_timestamp}\n")
             f.write(f"FPS: {self.settings['fps']}\n")
             x1, y1, x2, y2 = self.settings['region']
-            f.write(f"ROI: ({x1}, {y1}) to ({x2}, {y2})\n\n")
+            f.write(f"ROI: ({x1}, {y1}) to ({x2}, {y2})\n")
+            writer_stats = self.writer.stats()
+            if writer_stats["dropped"] or writer_stats["frames_dropped"]:
+                f.write(f"Not saved: {writer_stats['dropped']} incidents, "
+                        f"{writer_stats['frames_dropped']} incident images\n")
+            if writer_stats["failed"] or writer_stats["failed_images"]:
+                f.write(f"Failed to save: {writer_stats['failed']} incidents, "
+                        f"{writer_stats['failed_images']} incident images\n")
+            f.write("\nLatency:\n")
+            for line in summary_lines(self.engine.latency.summary()):
+                f.write(f"{line}\n")
+            f.write("\n")
             
             f.write("Settings:\n")
-            f.write(f"Green pixel threshold: {self.settings['green_threshold']}\n")
+            f.write(f"Color defect threshold: {self.settings['green_threshold']}\n")
             f.write(f"Frame drop threshold: {self.settings['frame_drop_threshold']}\n")
             f.write(f"Tearing threshold: {self.settings['tearing_threshold']}\n")
             f.write(f"Tearing min area: {self.settings['tearing_min_area']}\n\n")
             
-            for i, incident in enumerate(self.report):
-                f.write(f"Incident #{i+1}\n")
-                f.write(f"Timestamp: {incident['timestamp']}\n")
-                f.write(f"Type: {incident['type']}\n")
-                f.write(f"Details: {incident['details']}\n\n")
-                
-                # Сохраняем кадр
-                cv2.imwrite(os.path.join(report_dir, f"incident_{i+1}.png"), incident["frame"])
-        
-        return report_dir
+            for record in records:
+                f.write(f"Event #{record['number']}\n")
+                f.write(f"Timestamp: {record['timestamp']}\n")
+                f.write(f"Type: {record['type']}\n")
+                f.write(f"Details: {record['details']}\n")
+                if record.get("images"):
+                    f.write(f"Images: {', '.join(sorted(set(record['images'].values())))}\n")
+                elif record["image"]:
+                    f.write(f"Image: {record['image']}\n")
+                f.write("\n")
+        
+        return self.report_dir
 
 
 class RegionSelector(QMainWindow):
@@ -322,13 +343,30 @@ class VideoStreamAnalyzerApp(QMainWindow):
         self.settings = {
             'region': (0, 0, 640, 480),  # x1, y1, x2, y2
             'fps': 30,
-            'detect_green': True,
+            'detect_color_defects': True,
             'detect_frame_drops': True,
             'detect_tearing': True,
+            'detect_tear_line': True,
+            'detect_frozen_frames': True,
             'green_threshold': 100,
             'frame_drop_threshold': 1.5,  # коэффициент от ожидаемого интервала
             'tearing_threshold': 30,      # порог для обнаружения разницы между кадрами
-            'tearing_min_area': 500       # минимальная площадь контура для обнаружения разрыва
+            'tearing_min_area': 500,      # минимальная площадь контура для обнаружения разрыва
+            'buffer_size': 3,             # глубина истории кадров для детекторов
+            'queue_size': 8,              # размер очереди кадров между захватом и анализом
+            'detection_workers': 1,       # количество потоков детекторов
+            'schedule_policy': 'skip',    # пропущенный срок захвата: skip - пропустить, catch_up - догнать
+            'report_memory_limit': 50,    # сколько последних инцидентов держать в памяти
+            'report_queue_size': 32,      # кадров инцидентов в очереди записи на диск
+            'report_policy': 'drop_frame', # при переполнении очереди: block, drop_frame или drop
+            'image_format': 'png',        # формат кадров отчета: png, jpeg или webp
+            'image_quality': None,        # уровень сжатия PNG или качество JPEG/WebP, None - по умолчанию
+            'thumbnail_width': 320,       # ширина уменьшенных копий кадров, None - без них
+            'record_clips': False,        # сохранять видеоролики вокруг инцидентов
+            'clip_seconds': (3.0, 2.0),   # секунд видео до и после инцидента
+            'clip_scale': 0.25,           # масштаб кадров роликов
+            'profile_overlay': False,     # время стадий поверх превью
+            'preview_fps': 15             # частота обновления превью
         }
         
         # Инициализация UI
@@ -387,6 +425,22 @@ class VideoStreamAnalyzerApp(QMainWindow):
         fps_combo.currentTextChanged.connect(lambda value: self.update_setting('fps', int(value)))
         fps_layout.addWidget(fps_combo)
         
+        fps_layout.addWidget(QLabel("Preview FPS:"))
+        preview_fps_spin = QSpinBox()
+        preview_fps_spin.setRange(1, 60)
+        preview_fps_spin.setValue(self.settings['preview_fps'])
+        preview_fps_spin.valueChanged.connect(
+            lambda value: self.update_setting('preview_fps', value))
+        fps_layout.addWidget(preview_fps_spin)
+        
+        fps_layout.addWidget(QLabel("Detection Workers:"))
+        workers_spin = QSpinBox()
+        workers_spin.setRange(1, os.cpu_count() or 1)
+        workers_spin.setValue(self.settings['detection_workers'])
+        workers_spin.valueChanged.connect(
+            lambda value: self.update_setting('detection_workers', value))
+        fps_layout.addWidget(workers_spin)
+        
         settings_layout.addWidget(fps_group)
         
         # 3. Группа настроек обнаружения
@@ -394,10 +448,10 @@ class VideoStreamAnalyzerApp(QMainWindow):
         detection_layout = QVBoxLayout(detection_group)
         
         # Включение/выключение детекторов
-        self.green_check = QCheckBox("Detect Green Pixels")
-        self.green_check.setChecked(self.settings['detect_green'])
+        self.green_check = QCheckBox("Detect Color Defects")
+        self.green_check.setChecked(self.settings['detect_color_defects'])
         self.green_check.stateChanged.connect(
-            lambda state: self.update_setting('detect_green', state == Qt.Checked))
+            lambda state: self.update_setting('detect_color_defects', state == Qt.Checked))
         detection_layout.addWidget(self.green_check)
         
         self.frame_drop_check = QCheckBox("Detect Frame Drops")
@@ -412,6 +466,30 @@ class VideoStreamAnalyzerApp(QMainWindow):
             lambda state: self.update_setting('detect_tearing', state == Qt.Checked))
         detection_layout.addWidget(self.tearing_check)
         
+        self.tear_line_check = QCheckBox("Detect Tear Lines")
+        self.tear_line_check.setChecked(self.settings['detect_tear_line'])
+        self.tear_line_check.stateChanged.connect(
+            lambda state: self.update_setting('detect_tear_line', state == Qt.Checked))
+        detection_layout.addWidget(self.tear_line_check)
+        
+        self.frozen_check = QCheckBox("Detect Frozen/Repeated Frames")
+        self.frozen_check.setChecked(self.settings['detect_frozen_frames'])
+        self.frozen_check.stateChanged.connect(
+            lambda state: self.update_setting('detect_frozen_frames', state == Qt.Checked))
+        detection_layout.addWidget(self.frozen_check)
+        
+        self.clips_check = QCheckBox("Record Incident Clips")
+        self.clips_check.setChecked(self.settings['record_clips'])
+        self.clips_check.stateChanged.connect(
+            lambda state: self.update_setting('record_clips', state == Qt.Checked))
+        detection_layout.addWidget(self.clips_check)
+        
+        self.profile_check = QCheckBox("Show Profiling Overlay")
+        self.profile_check.setChecked(self.settings['profile_overlay'])
+        self.profile_check.stateChanged.connect(
+            lambda state: self.update_setting('profile_overlay', state == Qt.Checked))
+        detection_layout.addWidget(self.profile_check)
+        
         # Настройки порогов
         detection_layout.addWidget(QLabel("Green Pixel Threshold:"))
         green_threshold = QSpinBox()
@@ -446,6 +524,36 @@ class VideoStreamAnalyzerApp(QMainWindow):
             lambda value: self.update_setting('tearing_min_area', value))
         detection_layout.addWidget(tearing_area)
         
+        # Кадры отчета кодируются в фоне, здесь только формат, качество и миниатюры
+        detection_layout.addWidget(QLabel("Report Image Format:"))
+        image_format_combo = QComboBox()
+        image_format_combo.addItems(list(IMAGE_FORMATS))
+        image_format_combo.setCurrentText(self.settings['image_format'])
+        image_format_combo.currentTextChanged.connect(
+            lambda text: self.update_setting('image_format', text))
+        detection_layout.addWidget(image_format_combo)
+        
+        # Сжатие PNG 0-9, качество JPEG/WebP 0-100; минимум - значение OpenCV по умолчанию
+        detection_layout.addWidget(QLabel("Report Image Quality:"))
+        image_quality = QSpinBox()
+        image_quality.setRange(-1, 100)
+        image_quality.setSpecialValueText("Default")
+        quality = self.settings['image_quality']
+        image_quality.setValue(quality if quality is not None else -1)
+        image_quality.valueChanged.connect(
+            lambda value: self.update_setting('image_quality', value if value >= 0 else None))
+        detection_layout.addWidget(image_quality)
+        
+        detection_layout.addWidget(QLabel("Report Thumbnail Width:"))
+        thumbnail_width = QSpinBox()
+        thumbnail_width.setRange(0, 1920)
+        thumbnail_width.setSingleStep(80)
+        thumbnail_width.setSpecialValueText("Off")
+        thumbnail_width.setValue(self.settings['thumbnail_width'] or 0)
+        thumbnail_width.valueChanged.connect(
+            lambda value: self.update_setting('thumbnail_width', value or None))
+        detection_layout.addWidget(thumbnail_width)
+        
         settings_layout.addWidget(detection_group)
         
         # Кнопки управления
@@ -477,6 +585,15 @@ class VideoStreamAnalyzerApp(QMainWindow):
         self.status_label.setStyleSheet("font-weight: bold; color: #008800;")
         preview_layout.addWidget(self.status_label)
         
+        self.pipeline_label = QLabel("")
+        preview_layout.addWidget(self.pipeline_label)
+        
+        self.report_label = QLabel("")
+        preview_layout.addWidget(self.report_label)
+        
+        self.latency_label = QLabel("")
+        preview_layout.addWidget(self.latency_label)
+        
         # Добавляем виджеты в основной layout
         main_layout.addWidget(settings_widget, 1)
         main_layout.addWidget(preview_widget, 2)
@@ -535,9 +652,11 @@ class VideoStreamAnalyzerApp(QMainWindow):
             return
         
         # Создаем и запускаем поток анализа
-        self.analyzer_thread = ScreenAnalyzerThread(self.settings)
+        self.analyzer_thread = ScreenAnalyzerThread(self.settings, self.output_dir)
         self.analyzer_thread.update_signal.connect(self.update_preview)
         self.analyzer_thread.report_signal.connect(self.on_defect_detected)
+        self.analyzer_thread.save_progress_signal.connect(self.on_save_progress)
+        self.analyzer_thread.preview_size = (self.video_label.width(), self.video_label.height())
         self.analyzer_thread.start()
         
         self.is_analyzing = True
@@ -558,18 +677,17 @@ class VideoStreamAnalyzerApp(QMainWindow):
     def update_preview(self, frame_data):
         frame = frame_data["frame"]
         analysis_results = frame_data["analysis"]
-        
-        # Конвертируем кадр для отображения в QLabel
-        height, width, channel = frame.shape
-        bytes_per_line = 3 * width
-        q_img = QImage(frame.data, width, height, bytes_per_line, QImage.Format_RGB888).rgbSwapped()
-        pixmap = QPixmap.fromImage(q_img)
-        
-        # Масштабируем изображение до размера QLabel, сохраняя пропорции
-        pixmap = pixmap.scaled(self.video_label.width(), self.video_label.height(), 
-                              Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        
-        self.video_label.setPixmap(pixmap)
+        render_start = time.perf_counter()
+        
+        # Кадр уже уменьшен до размера QLabel и переведен в RGB в потоке
+        # анализа, QImage только оборачивает буфер без копирования
+        height, width = frame.shape[:2]
+        q_img = QImage(frame.data, width, height, frame.strides[0], QImage.Format_RGB888)
+        self.video_label.setPixmap(QPixmap.fromImage(q_img))
+        if self.analyzer_thread is not None:
+            # Отрисовка идет в потоке GUI, ее время тоже попадает в разбивку
+            self.analyzer_thread.engine.latency.record("preview.render", time.perf_counter() - render_start)
+            self.analyzer_thread.preview_shown()
         
         # Обновляем статус, если обнаружены дефекты
         if analysis_results:
@@ -579,16 +697,40 @@ class VideoStreamAnalyzerApp(QMainWindow):
         else:
             self.status_label.setText("Analyzing...")
             self.status_label.setStyleSheet("font-weight: bold; color: #008800;")
+        
+        # Счетчики конвейера: пропуски самого анализатора и разрывы в источнике
+        stats = frame_data.get("stats")
+        if stats:
+            self.pipeline_label.setText(
+                f"Captured: {stats['captured']} | Analyzed: {stats['processed']} | "
+                f"Dropped by analyzer: {stats['dropped']} | Source gaps: {stats['source_gaps']} | "
+                f"Missed deadlines: {stats['missed_deadlines']} | "
+                f"Preview skipped: {stats['preview_dropped']}")
+        
+        # Интервал между кадрами и задержка обработки: p50/p95/p99/max
+        latency = frame_data.get("latency")
+        if latency:
+            self.latency_label.setText("\n".join(format_summary(name, latency[name])
+                                                 for name in ("interval", "frame") if name in latency))
+    
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # Поток анализа уменьшает кадры превью под новый размер
+        if self.analyzer_thread is not None:
+            self.analyzer_thread.preview_size = (self.video_label.width(), self.video_label.height())
     
     def on_defect_detected(self, message, frame):
         self.statusBar.showMessage(message, 3000)
     
+    def on_save_progress(self, written, total):
+        self.report_label.setText(f"Report: {written}/{total} events saved")
+    
     def save_report(self):
         if not self.analyzer_thread:
             self.statusBar.showMessage("No analysis data to save")
             return
         
-        report_path = self.analyzer_thread.save_report(self.output_dir)
+        report_path = self.analyzer_thread.save_report()
         if report_path == "No issues to report":
             self.statusBar.showMessage("No issues detected, no report generated")
         else:
@@ -0,0 +1,330 @@
+"""Synthetic defect-injection benchmark for the detectors.
+
+Generates frame sequences with known defects at several resolutions, runs
+the DetectionEngine on them without a display and writes speed, memory
+and accuracy figures to a JSON file. Pass an earlier file as --baseline
+to list regressions (the exit code is 1 when there are any):
+
+    python benchmark.py --resolutions 720p 1080p --output bench.json
+    python benchmark.py --baseline bench.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import cv2
+import numpy as np
+from frame_source import FrameSource
+from frame_buffer import FrameRingBuffer
+from engine import DetectionEngine
+
+RESOLUTIONS = {
+    "480p": (640, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160)
+}
+
+# Injected defects: (type, start, duration) in seconds of a 10 s sequence
+SCHEDULE = [
+    ("green_block", 1.0, 0.15),
+    ("gap", 1.5, 0.0),
+    ("tear", 2.0, 0.0),
+    ("frozen", 3.0, 1.5),
+    ("tear", 5.0, 0.0),
+    ("duplicate", 5.5, 2.5),
+    ("green_block", 8.5, 0.1),
+    ("gap", 9.0, 0.0),
+    ("tear", 9.5, 0.0)
+]
+
+# Detector that should report each defect type, the message its incidents
+# start with (None for any) and how many frames after the defect its
+# reports still count as hits
+DEFECTS = {
+    "green_block": ("color_defects", None, 0),
+    "tear": ("tear_line", None, 0),
+    # The effective rate is measured over a 2 s window, which still holds
+    # repeated frames for a while after the defect
+    "frozen": ("frozen_frames", "Frozen picture", 2.0),
+    "duplicate": ("frozen_frames", "Repeated frames", 2.0),
+    "gap": ("frame_drop", None, 0)
+}
+
+# Ratio by which a figure may get worse before it counts as a regression
+TOLERANCE = 0.2
+
+
+class InjectedFrameSource(FrameSource):
+    """Synthetic frames with defects inserted at known frames.
+
+    The clean content is a gray gradient whose brightness moves 4 levels
+    per frame in a triangle wave, so every frame differs from its
+    neighbours without triggering the change based detectors. `defects`
+    holds (type, first, last) frame ranges:
+
+    - green_block: a green rectangle over the frame
+    - tear: the rows above a seam come from the previous frame, the rows
+      below it from the next one
+    - frozen: the first frame of the range is repeated
+    - duplicate: every second frame repeats the one before (half rate)
+    - gap: the frame arrives three periods late
+    """
+
+    realtime = False
+
+    def __init__(self, width, height, fps, frames, defects):
+        super().__init__()
+        self.width, self.height = width, height
+        self.fps = fps
+        self.frames = frames
+        self.defects = defects
+        self.index = 0
+        self._buffer = np.empty((height, width, 3), dtype=np.uint8)
+        self._other = np.empty((height, width, 3), dtype=np.uint8)
+        ramp = np.linspace(32, 192, width, dtype=np.uint8)
+        self._background = np.empty((height, width, 3), dtype=np.uint8)
+        self._background[:] = ramp[None, :, None]
+        self._delay = np.zeros(frames)
+        for kind, first, last in defects:
+            if kind == "gap":
+                self._delay[first:] += 2.0 / fps
+
+    @staticmethod
+    def brightness(content):
+        """Brightness offset of clean frame `content`, a triangle wave of 4 levels per frame"""
+        phase = content % 32
+        return 4 * (phase if phase < 16 else 32 - phase)
+
+    def content(self, index):
+        """Index of the clean frame shown as frame `index`"""
+        for kind, first, last in self.defects:
+            if first <= index <= last:
+                if kind == "frozen":
+                    return first
+                if kind == "duplicate":
+                    return index - (index - first) % 2
+        return index
+
+    def render_content(self, content, out):
+        """Draw clean frame `content` into `out`, which may be the top rows of a frame only"""
+        offset = self.brightness(content)
+        cv2.add(self._background[:out.shape[0]], (offset, offset, offset, 0), dst=out)
+        return out
+
+    def render(self, index, out):
+        self.render_content(self.content(index), out)
+        for kind, first, last in self.defects:
+            if not first <= index <= last:
+                continue
+            if kind == "green_block":
+                h, w = self.height // 6, self.width // 6
+                out[self.height // 3:self.height // 3 + h, self.width // 3:self.width // 3 + w] = (0, 200, 0)
+            elif kind == "tear":
+                seam = self.height // 2 + self.height // 7
+                self.render_content(index - 1, out[:seam])
+                self.render_content(index + 1, self._other)
+                out[seam:] = self._other[seam:]
+        return out
+
+    def read(self, out=None):
+        if self.index >= self.frames:
+            return None, None
+        if out is None:
+            out = self._buffer
+        self.render(self.index, out)
+        timestamp = self.index / float(self.fps) + self._delay[self.index]
+        self.index += 1
+        return out, timestamp
+
+
+def build_defects(fps, frames):
+    """Frame ranges of SCHEDULE that fit into `frames`"""
+    defects = []
+    for kind, start, duration in SCHEDULE:
+        first = int(round(start * fps))
+        last = first + max(int(round(duration * fps)) - 1, 0)
+        if kind == "tear":
+            # The neighbours have to differ in the same direction, so the
+            # seam is not put on a turning point of the brightness wave
+            while first % 16 in (0, 15):
+                first += 1
+            last = first
+        if last < frames - 1:
+            defects.append((kind, first, last))
+    return defects
+
+
+def score(incidents, defects, fps):
+    """Recall per defect type and precision per detector.
+
+    A defect is found when its detector reported on one of its frames. A
+    report is a hit when it falls on (or shortly after) a defect the
+    detector is meant to find.
+    """
+    def matches(incident, kind):
+        detector, prefix, _ = DEFECTS[kind]
+        return incident["type"] == detector and (prefix is None or incident["message"].startswith(prefix))
+
+    def within(incident, kind, first, last):
+        slack = int(round(DEFECTS[kind][2] * fps))
+        return first <= incident["index"] <= last + slack
+
+    found = {}
+    for kind, first, last in defects:
+        entry = found.setdefault(kind, {"detector": DEFECTS[kind][0], "instances": 0, "found": 0})
+        entry["instances"] += 1
+        if any(matches(incident, kind) and first <= incident["index"] <= last for incident in incidents):
+            entry["found"] += 1
+    for entry in found.values():
+        entry["recall"] = entry["found"] / entry["instances"]
+
+    reports = {}
+    for incident in incidents:
+        entry = reports.setdefault(incident["type"], {"incidents": 0, "hits": 0})
+        entry["incidents"] += 1
+        if any(DEFECTS[kind][0] == incident["type"] and within(incident, kind, first, last)
+               for kind, first, last in defects):
+            entry["hits"] += 1
+    for entry in reports.values():
+        entry["precision"] = entry["hits"] / entry["incidents"]
+    return found, reports
+
+
+def peak_rss_mb():
+    """Memory high-water mark of this process"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+
+def run_resolution(name, frames=300, fps=30):
+    """Benchmark one resolution, meant to run in a fresh process so memory is its own"""
+    width, height = RESOLUTIONS[name]
+    defects = build_defects(fps, frames)
+    source = InjectedFrameSource(width, height, fps, frames, defects)
+    engine = DetectionEngine(fps, offline=True)
+    ring = FrameRingBuffer(engine.history + 2, height, width)
+    ring.latency = engine.latency
+
+    incidents = []
+    while True:
+        index = ring.capture(source)
+        if index is None:
+            break
+        for incident in engine.process(ring.context(index)):
+            incident.pop("frame", None)
+            incidents.append(incident)
+
+    latency = engine.latency.summary()
+    frame = latency["frame"]
+    found, reports = score(incidents, defects, fps)
+    detectors = {}
+    for detector in engine.detectors:
+        stats = latency.get("detect." + detector.name)
+        if stats is None:
+            continue
+        detectors[detector.name] = dict(reports.get(detector.name, {"incidents": 0, "hits": 0,
+                                                                      "precision": None}),
+                                        ms_per_frame=stats["mean"] * 1000, p95_ms=stats["p95"] * 1000)
+    return {
+        "width": width,
+        "height": height,
+        "frames": frames,
+        "fps": frames / frame["total"] if frame["total"] else None,
+        "frame_ms": {key: frame[key] * 1000 for key in ("mean", "p50", "p95", "p99", "max")},
+        "detectors": detectors,
+        "defects": found,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Regressions of `results` against a `baseline` results file, as text lines"""
+    regressions = []
+    for name, current in results["resolutions"].items():
+        previous = baseline.get("resolutions", {}).get(name)
+        if previous is None:
+            continue
+        if current["fps"] and previous["fps"] and current["fps"] < previous["fps"] * (1 - tolerance):
+            regressions.append(f"{name}: {current['fps']:.1f} FPS, was {previous['fps']:.1f}")
+        for detector, stats in current["detectors"].items():
+            before = previous["detectors"].get(detector)
+            if before is None:
+                continue
+            if stats["ms_per_frame"] > before["ms_per_frame"] * (1 + tolerance):
+                regressions.append(f"{name} {detector}: {stats['ms_per_frame']:.2f} ms/frame, "
+                                   f"was {before['ms_per_frame']:.2f}")
+            if stats["precision"] is not None and before["precision"] is not None and \
+                    stats["precision"] < before["precision"]:
+                regressions.append(f"{name} {detector}: precision {stats['precision']:.2f}, "
+                                   f"was {before['precision']:.2f}")
+        for kind, stats in current["defects"].items():
+            before = previous["defects"].get(kind)
+            if before is not None and stats["recall"] < before["recall"]:
+                regressions.append(f"{name} {kind}: recall {stats['recall']:.2f}, was {before['recall']:.2f}")
+    return regressions
+
+
+def run(resolutions, frames=300, fps=30):
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "opencv": cv2.__version__, "cpus": os.cpu_count()},
+        "fps": fps,
+        "resolutions": {}
+    }
+    for name in resolutions:
+        # A fresh process per resolution, so the memory high-water mark is
+        # not the one of a bigger resolution that ran before
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as executor:
+            result = executor.submit(run_resolution, name, frames, fps).result()
+        results["resolutions"][name] = result
+        print(f"{name}: {result['fps']:.1f} FPS, frame p95 {result['frame_ms']['p95']:.2f} ms, "
+              f"peak {result['peak_rss_mb']:.0f} MB")
+        for detector, stats in result["detectors"].items():
+            precision = f"{stats['precision']:.2f}" if stats["precision"] is not None else "-"
+            print(f"  {detector:<16}{stats['ms_per_frame']:>8.2f} ms/frame  "
+                  f"{stats['incidents']:>4} reports  precision {precision}")
+        for kind, stats in result["defects"].items():
+            print(f"  {kind:<16}recall {stats['recall']:.2f} ({stats['found']}/{stats['instances']})")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolutions", nargs="+", choices=list(RESOLUTIONS), default=list(RESOLUTIONS))
+    parser.add_argument("--frames", type=int, default=300, help="frames per sequence (defects fit into 300)")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="how much worse speed may get before it is a regression")
+    args = parser.parse_args(argv)
+
+    results = run(args.resolutions, args.frames, args.fps)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"Regression: {line}")
+        if regressions:
+            return 1
+        print("No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
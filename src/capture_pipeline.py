@@ -0,0 +1,207 @@
+import queue
+import threading
+import time
+from frame_buffer import FrameRingBuffer
+from scheduler import DeadlineScheduler
+
+
+class CaptureThread(threading.Thread):
+    """Read frames from a source into a ring buffer and queue them for detection.
+
+    Frames are written straight into the next ring buffer slot. Queued frames
+    (and up to `history` frames before them, which detectors compare
+    against) stay pinned until a worker releases them. The capture thread
+    owns the source: it opens it lazily on the first read and closes it
+    when it exits. Live sources are paced by a DeadlineScheduler whose
+    `policy` decides what happens after a missed deadline. With `latency`
+    (a LatencyStats) every read is timed as "capture" and every interval
+    between two grabs is recorded as "interval", frames the analyzer
+    skipped included.
+    """
+
+    def __init__(self, source, frame_queue, ring, fps, gap_threshold=1.5, history=1,
+                 policy="skip", latency=None):
+        super().__init__(daemon=True)
+        self.source = source
+        self.frame_queue = frame_queue
+        self.ring = ring
+        self.history = history
+        self.fps = fps
+        self.gap_threshold = gap_threshold
+        self.scheduler = DeadlineScheduler(fps, policy)
+        self.latency = latency
+        source.latency = latency
+        self.running = False
+
+        self.captured = 0
+        self.dropped = 0        # frames the analyzer had no time for
+        self.source_gaps = 0    # intervals in the source longer than expected
+
+    def run(self):
+        self.running = True
+        prev_index = None
+        prev_time = None
+        skipped = False
+
+        try:
+            while self.running:
+                if self.source.realtime:
+                    # Live grabs start on absolute deadlines, so the analyzer's
+                    # own jitter does not show up as frame drops
+                    self.scheduler.set_fps(self.fps)
+                    before = self.scheduler.skipped
+                    self.scheduler.wait()
+                    # Deadlines the "skip" policy dropped are our gap, not the source's
+                    skipped = skipped or self.scheduler.skipped != before
+
+                # Offline sources wait for a free slot, live ones cannot
+                writable = self.ring.writable()
+                while not writable and not self.source.realtime and self.running:
+                    time.sleep(0.001)
+                    writable = self.ring.writable()
+
+                # When every slot is still in use the frame is read into the
+                # source's own buffer only to keep its timestamp
+                start = time.perf_counter()
+                frame, source_time = self.source.read(out=self.ring.next_slot() if writable else None)
+                if self.latency is not None:
+                    self.latency.record("capture", time.perf_counter() - start)
+                if frame is None:
+                    if self.source.realtime:
+                        continue
+                    break
+
+                # Live frames are stamped with the scheduler's monotonic clock
+                # right after the grab, offline ones keep their container
+                # timestamps
+                timestamp = self.scheduler.now() if self.source.realtime else source_time
+                self.captured += 1
+
+                expected_interval = 1.0 / self.fps
+                if prev_time is not None:
+                    if timestamp - prev_time > expected_interval * self.gap_threshold and not skipped:
+                        self.source_gaps += 1
+                    if self.latency is not None:
+                        self.latency.record("interval", timestamp - prev_time)
+
+                if writable:
+                    # A frame skipped before this one breaks the comparison
+                    # with the previous buffered frame
+                    index = self.ring.commit(timestamp, gap=prev_index is None or skipped)
+                    item = {
+                        "index": index,
+                        "time": timestamp,
+                        "frame": self.ring.frame(index),
+                        "context": self.ring.context(index),
+                        "pins": tuple(self.ring.history(index, self.history))
+                    }
+                    self.ring.pin(*item["pins"])
+                    self.put(item)
+                    prev_index = index
+                else:
+                    self.dropped += 1
+                    prev_index = None
+                prev_time = timestamp
+                skipped = False
+        finally:
+            self.running = False
+            self.source.close()
+
+    def put(self, item):
+        """Queue a frame; live sources drop the oldest frame when the queue is full"""
+        if not self.source.realtime:
+            # Offline sources can wait for the detectors
+            while self.running:
+                try:
+                    self.frame_queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+            return
+
+        try:
+            self.frame_queue.put_nowait(item)
+        except queue.Full:
+            try:
+                oldest = self.frame_queue.get_nowait()
+                self.ring.release(*oldest["pins"])
+                self.dropped += 1
+            except queue.Empty:
+                pass
+            self.frame_queue.put_nowait(item)
+
+    def stop(self):
+        self.running = False
+
+
+class FramePipeline:
+    """A capture thread feeding detection workers through a bounded queue.
+
+    Frame indices start at `start`, so a pipeline replacing another one can
+    continue its numbering.
+    """
+
+    def __init__(self, source, process, fps, queue_size=8, workers=1, gap_threshold=1.5, history=3,
+                 policy="skip", latency=None, start=0):
+        workers = max(workers, 1)
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+
+        # Enough slots for every queued frame, every frame being analyzed and
+        # the history detectors look back on
+        self.ring = FrameRingBuffer(queue_size + workers + history, source.height, source.width,
+                                    start=start)
+        self.ring.latency = latency
+        self.capture = CaptureThread(source, self.frame_queue, self.ring, fps, gap_threshold, history,
+                                     policy, latency)
+        self.process = process
+        self.workers = [threading.Thread(target=self._worker, daemon=True)
+                        for _ in range(workers)]
+        self.processed = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def start(self):
+        self.capture.start()
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        """Stop capturing and discard frames that were not analyzed yet"""
+        self._stopped = True
+        self.capture.stop()
+        self.join()
+
+    def join(self, timeout=None):
+        """Wait until the source is exhausted and every queued frame is analyzed"""
+        self.capture.join(timeout)
+        for worker in self.workers:
+            worker.join(timeout)
+
+    def is_alive(self):
+        return any(worker.is_alive() for worker in self.workers)
+
+    def stats(self):
+        return {
+            "captured": self.capture.captured,
+            "processed": self.processed,
+            "dropped": self.capture.dropped,
+            "source_gaps": self.capture.source_gaps,
+            "missed_deadlines": self.capture.scheduler.missed,
+            "queued": self.frame_queue.qsize()
+        }
+
+    def _worker(self):
+        while not self._stopped:
+            try:
+                item = self.frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self.capture.is_alive() and self.frame_queue.empty():
+                    break
+                continue
+
+            try:
+                self.process(item)
+            finally:
+                self.ring.release(*item["pins"])
+            with self._lock:
+                self.processed += 1
@@ -0,0 +1,196 @@
+"""Headless batch analysis, driven by command line options or a JSON config file.
+
+No preview window and no prompts, so it runs unattended under Xvfb or on
+recorded files at full speed:
+
+    python cli.py recording.mp4 --workers 2 --output-dir reports
+    python cli.py screen --roi 0 0 1280 720 --fps 30 --duration 600
+    python cli.py --config nightly.json --set color_defects.threshold=500
+    python cli.py screen --region left 0 0 960 540 --region right 960 0 1920 540
+
+A config file holds the same options with underscores ("output_dir",
+"clip_seconds", ...) plus "thresholds": {"detector": {"name": value}} and
+"regions": {"name": {"roi": [x1, y1, x2, y2], "detectors": [...],
+"thresholds": {...}}}; command line options override it. Regions get the
+global detector selection and thresholds unless they set their own.
+
+Exit codes: 0 no defects found, 1 defects found, 2 invalid arguments or
+config, 3 the source could not be opened, 4 the analysis failed,
+130 interrupted.
+"""
+import argparse
+import json
+import sys
+from detectors import DETECTORS
+from multi_roi import bounding_box
+from report_writer import IMAGE_FORMATS
+from scheduler import DeadlineScheduler
+from screen_analyzer import ScreenAnalyzer
+
+EXIT_CLEAN = 0
+EXIT_DEFECTS = 1
+EXIT_USAGE = 2
+EXIT_SOURCE = 3
+EXIT_FAILED = 4
+EXIT_INTERRUPTED = 130
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", nargs="?",
+                        help='"screen", "synthetic[:pattern]" or a video file (default: screen)')
+    parser.add_argument("--config", help="JSON file with default values for these options")
+    parser.add_argument("--roi", nargs=4, type=int, metavar=("X1", "Y1", "X2", "Y2"),
+                        help="screen region; for synthetic sources only the size is used (video files: --region)")
+    parser.add_argument("--region", nargs=5, action="append", metavar=("NAME", "X1", "Y1", "X2", "Y2"),
+                        dest="region_args", help="named ROI analyzed on its own, can be repeated")
+    parser.add_argument("--fps", type=float, help="capture rate, for video files the container rate is used")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds of the source")
+    parser.add_argument("--frames", type=int, help="stop after this many frames")
+    parser.add_argument("--detectors", nargs="+", choices=list(DETECTORS),
+                        help="run only these detectors")
+    parser.add_argument("--disable", nargs="+", choices=list(DETECTORS), help="detectors to turn off")
+    parser.add_argument("--set", action="append", metavar="DETECTOR.NAME=VALUE", dest="overrides",
+                        help="detector threshold, the value is parsed as JSON when possible")
+    parser.add_argument("--output-dir", help="reports are written to report_<timestamp> here")
+    parser.add_argument("--workers", type=int, help="detection processes, 0 runs detectors in this process")
+    parser.add_argument("--image-format", choices=list(IMAGE_FORMATS))
+    parser.add_argument("--image-quality", type=int)
+    parser.add_argument("--clip-seconds", nargs=2, type=float, metavar=("BEFORE", "AFTER"),
+                        help="save video clips around incidents")
+    parser.add_argument("--schedule-policy", choices=DeadlineScheduler.POLICIES)
+    parser.add_argument("--quiet", action="store_true", default=None,
+                        help="do not print incidents as they are detected")
+    return parser
+
+
+def load_config(parser, argv):
+    """Parse `argv` with the values of --config as defaults"""
+    args, _ = parser.parse_known_args(argv)
+    thresholds = {}
+    regions = {}
+    if args.config:
+        try:
+            with open(args.config) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read config {args.config}: {e}")
+        thresholds = config.pop("thresholds", {})
+        regions = config.pop("regions", {})
+        known = {action.dest for action in parser._actions}
+        unknown = set(config) - known
+        if unknown:
+            parser.error(f"unknown config keys: {', '.join(sorted(unknown))}")
+        parser.set_defaults(**config)
+    args = parser.parse_args(argv)
+    args.thresholds = {name: dict(values) for name, values in thresholds.items()}
+    for override in args.overrides or []:
+        key, sep, value = override.partition("=")
+        name, dot, threshold = key.partition(".")
+        if not sep or not dot:
+            parser.error(f"--set expects DETECTOR.NAME=VALUE, got '{override}'")
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        args.thresholds.setdefault(name, {})[threshold] = value
+
+    args.regions = {name: dict(region) for name, region in regions.items()}
+    for name, *roi in args.region_args or []:
+        try:
+            args.regions.setdefault(name, {})["roi"] = [int(value) for value in roi]
+        except ValueError:
+            parser.error(f"--region {name} expects four integer coordinates")
+    for name, region in args.regions.items():
+        if len(region.get("roi") or ()) != 4:
+            parser.error(f"region {name} needs a roi of four coordinates")
+        # Global settings first, the region's own on top
+        if "detectors" not in region and args.detectors is not None:
+            region["detectors"] = list(args.detectors)
+        if args.disable:
+            region["detectors"] = [detector for detector in region.get("detectors", DETECTORS)
+                                   if detector not in args.disable]
+        region_thresholds = {detector: dict(values) for detector, values in args.thresholds.items()}
+        for detector, values in region.get("thresholds", {}).items():
+            region_thresholds.setdefault(detector, {}).update(values)
+        region["thresholds"] = {detector: values for detector, values in region_thresholds.items()
+                                if detector in region.get("detectors", DETECTORS)}
+    return args
+
+
+def configure(analyzer, args, parser):
+    """Apply the parsed options to a ScreenAnalyzer"""
+    engine = analyzer.engine
+    try:
+        for detector in engine.detectors:
+            if args.detectors is not None:
+                detector.enabled = detector.name in args.detectors
+            if args.disable and detector.name in args.disable:
+                detector.enabled = False
+        for name, values in args.thresholds.items():
+            engine.configure(name, **values)
+    except KeyError as e:
+        parser.error(f"unknown detector {e}")
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.fps is not None:
+        analyzer.current_fps = args.fps
+        engine.fps = args.fps
+    if args.workers is not None:
+        analyzer.workers = args.workers
+    if args.image_format is not None:
+        analyzer.image_format = args.image_format
+    if args.image_quality is not None:
+        analyzer.image_quality = args.image_quality
+    if args.clip_seconds is not None:
+        analyzer.clip_seconds = tuple(args.clip_seconds)
+    if args.schedule_policy is not None:
+        analyzer.schedule_policy = args.schedule_policy
+    analyzer.duration = args.duration
+    analyzer.max_frames = args.frames
+    analyzer.verbose = not args.quiet
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = load_config(parser, argv)
+    source = args.source or "screen"
+    if source == "screen" and args.roi is None and not args.regions:
+        parser.error("screen capture needs --roi or --region")
+    if args.roi is not None and source != "screen" and not source.startswith("synthetic"):
+        parser.error("--roi is not applied to video files, use --region to analyze part of the frame")
+    if source.startswith("synthetic") and args.duration is None and args.frames is None:
+        parser.error("synthetic sources never end, give --duration or --frames")
+
+    analyzer = ScreenAnalyzer(args.output_dir or "reports")
+    configure(analyzer, args, parser)
+    roi = tuple(args.roi) if args.roi else None
+    if source == "screen" and args.regions:
+        roi = bounding_box(args.regions)
+    try:
+        analyzer.open_source(source, roi)
+    except Exception as e:
+        print(f"Cannot open source {source}: {e}", file=sys.stderr)
+        return EXIT_SOURCE
+    if args.regions:
+        # Checked against the size of the opened source
+        try:
+            analyzer.set_regions(args.regions)
+        except ValueError as e:
+            analyzer.source.close()
+            parser.error(str(e))
+
+    try:
+        analyzer.start_analysis(show_preview=False)
+    except Exception as e:
+        print(f"Analysis failed: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    if analyzer.interrupted:
+        return EXIT_INTERRUPTED
+    engine = analyzer.region_engine or analyzer.engine
+    return EXIT_DEFECTS if engine.incident_count else EXIT_CLEAN
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import json
+import math
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+
+CLIPS_FILE = "clips.jsonl"
+
+
+class ClipRecorder:
+    """Saves a short video around incidents from a rolling frame buffer.
+
+    The last `pre + post` seconds of frames are kept downscaled by `scale`
+    in one preallocated array, addressed by frame index like the
+    FrameRingBuffer, so memory is fixed however long the session runs and
+    frames may arrive slightly out of order. When an incident fires, a clip
+    from `pre` seconds before it to `post` seconds after it is cut once the
+    later frames are in; incidents meanwhile extend the clip up to the
+    buffer length. A new clip starts at most every `min_interval` seconds.
+
+    Clips are encoded by a background thread into clip_<n>.mp4 and listed
+    in clips.jsonl. At most `queue_size` clips wait for it, further clips
+    are dropped and counted, so memory never exceeds (1 + queue_size)
+    buffers of downscaled frames. A clip that fails to encode or write is
+    logged and counted in `failed`, the thread goes on with the next one.
+    """
+
+    def __init__(self, report_dir, fps, pre=3.0, post=2.0, scale=0.25, min_interval=10.0,
+                 queue_size=1, fourcc="mp4v"):
+        self.report_dir = report_dir
+        self.fps = fps
+        self.pre = max(int(round(pre * fps)), 0)
+        self.post = max(int(round(post * fps)), 1)
+        # A second of slack for incidents that are reported late (process
+        # pool, detectors looking back)
+        self.capacity = self.pre + self.post + int(math.ceil(fps)) + 1
+        self.scale = scale
+        self.min_interval = int(round(min_interval * fps))
+        self.fourcc = fourcc
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.frames = None
+        self.size = None
+        self.indices = np.full(self.capacity, -1, dtype=np.int64)
+        self.times = np.zeros(self.capacity, dtype=np.float64)
+        self._pending = None
+        self._last_start = None
+        self._count = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="ClipRecorder", daemon=True)
+        self._thread.start()
+
+    def add(self, index, frame_time, frame):
+        """Store a downscaled copy of frame `index`"""
+        with self._lock:
+            if self.frames is None:
+                height, width = frame.shape[:2]
+                # Even sizes keep common video codecs happy
+                self.size = (max(int(width * self.scale) // 2 * 2, 2),
+                             max(int(height * self.scale) // 2 * 2, 2))
+                self.frames = np.zeros((self.capacity, self.size[1], self.size[0], 3), dtype=np.uint8)
+            slot = index % self.capacity
+            cv2.resize(frame, self.size, dst=self.frames[slot],
+                       interpolation=cv2.INTER_AREA)
+            self.indices[slot] = index
+            self.times[slot] = frame_time
+
+            if self._pending is not None and index >= self._pending["end"]:
+                self._cut()
+
+    def trigger(self, incident):
+        """Record a clip around an incident (or extend the one being recorded)"""
+        index = incident["index"]
+        with self._lock:
+            if self._pending is not None:
+                self._pending["end"] = min(max(self._pending["end"], index + self.post),
+                                           self._pending["start"] + self.capacity - 1)
+                self._pending["types"].add(incident["type"])
+                return
+            if self._last_start is not None and index - self._last_start < self.min_interval:
+                return
+            self._last_start = index
+            self._pending = {"start": max(index - self.pre, 0), "end": index + self.post,
+                             "types": {incident["type"]}}
+
+    def _cut(self):
+        clip, self._pending = self._pending, None
+        indices = [i for i in range(clip["start"], clip["end"] + 1)
+                   if self.indices[i % self.capacity] == i]
+        if not indices:
+            return
+        slots = [i % self.capacity for i in indices]
+        clip.update({
+            "start": indices[0], "end": indices[-1],
+            "start_time": float(self.times[slots[0]]), "end_time": float(self.times[slots[-1]]),
+            "types": sorted(clip["types"])
+        })
+        try:
+            # The copy is what lets the buffer move on while the clip is encoded
+            self._queue.put_nowait((clip, self.frames[slots]))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            clip, frames = item
+            self._count += 1
+            clip["file"] = f"clip_{self._count}.mp4"
+            try:
+                self._write(clip, frames)
+            except Exception as e:
+                self.failed += 1
+                print(f"Could not save clip {clip['file']}: {e}")
+                continue
+            self.written += 1
+
+    def _write(self, clip, frames):
+        os.makedirs(self.report_dir, exist_ok=True)
+        writer = cv2.VideoWriter(os.path.join(self.report_dir, clip["file"]),
+                                 cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self.size)
+        if not writer.isOpened():
+            raise IOError("the video writer could not be opened")
+        try:
+            for frame in frames:
+                writer.write(frame)
+        finally:
+            writer.release()
+        with open(os.path.join(self.report_dir, CLIPS_FILE), "a") as f:
+            f.write(json.dumps(clip) + "\n")
+
+    def stats(self):
+        return {"written": self.written, "dropped": self.dropped, "failed": self.failed,
+                "queued": self._queue.qsize()}
+
+    def restart(self):
+        """Cut the clip in progress and forget the buffered frames, when the picture changes"""
+        with self._lock:
+            if self._pending is not None:
+                self._cut()
+            self.indices[:] = -1
+
+    def close(self, timeout=30.0):
+        """Cut the clip in progress with the frames there are and wait for the encoder.
+
+        Gives up after `timeout` seconds, so a stuck encoder cannot hang the
+        end of a session.
+        """
+        with self._lock:
+            if self._pending is not None:
+                self._cut()
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            print("Clip encoder is not responding, clips still queued are lost")
+            return
+        self._thread.join(timeout)
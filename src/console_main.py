@@ -1,13 +1,39 @@
+import argparse
 import sys
 import time
+from cli import EXIT_CLEAN, EXIT_SOURCE
 from screen_analyzer import ScreenAnalyzer
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Screen Video Stream Analyzer (Console Edition)")
+    parser.add_argument("video", nargs="?", help="analyze this video file offline instead of the screen")
+    parser.add_argument("workers", nargs="?", type=int, default=0,
+                        help="detection processes for the video file, 0 runs detectors in this process")
+    parser.add_argument("--profile-overlay", action="store_true",
+                        help="draw the costliest stages on the preview window")
+    args = parser.parse_args(argv)
+    if args.workers < 0:
+        parser.error("workers must not be negative")
+    
     analyzer = ScreenAnalyzer()
+    analyzer.profile_overlay = args.profile_overlay
     
     print("Welcome to Screen Video Stream Analyzer (Console Edition)")
     print("-" * 50)
     
+    # Offline mode: analyze a recorded file as fast as possible, optionally
+    # with detectors spread over several processes
+    if args.video:
+        try:
+            analyzer.open_video(args.video)
+        except Exception as e:
+            print(f"Cannot open source {args.video}: {e}", file=sys.stderr)
+            return EXIT_SOURCE
+        analyzer.workers = args.workers
+        analyzer.start_analysis(show_preview=False)
+        print("\nAnalysis complete. Check the 'reports' directory for results.")
+        return EXIT_CLEAN
+    
     # Set FPS
     print("\nAvailable FPS options:")
     for i, fps in enumerate(analyzer.fps_options):
@@ -32,7 +58,7 @@ def main():
     
     if not analyzer.roi_selected:
         print("ROI selection canceled. Exiting.")
-        return
+        return EXIT_CLEAN
     
     # Start analysis
     print("\nPress Ctrl+C to stop the analysis")
@@ -47,6 +73,7 @@ def main():
         analyzer.stop_analysis()
         
     print("\nAnalysis complete. Check the 'reports' directory for results.")
+    return EXIT_CLEAN
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,433 @@
+import collections
+import threading
+import cv2
+import numpy as np
+from kernels import (default_tiles, grid, diff_threshold_tiles, reduce_tiles, flag_cells, channel_luts,
+                     color_lut_tiles)
+
+# Registered detector classes by name, in registration order
+DETECTORS = {}
+
+
+def register_detector(cls):
+    """Class decorator adding a detector to the registry"""
+    DETECTORS[cls.name] = cls
+    return cls
+
+
+def create_detector(name, **thresholds):
+    if name not in DETECTORS:
+        raise ValueError(f"Unknown detector '{name}', choose from {list(DETECTORS)}")
+    return DETECTORS[name](**thresholds)
+
+
+class Detector:
+    """Base class for defect detectors.
+
+    A detector looks at one FrameContext and returns an incident dict (with
+    at least "details", "message", "metric" and an annotated "frame") or
+    None. Subclasses declare:
+
+    - name: registry key, also used as the incident type
+    - label: short human readable name for status lines
+    - inputs: the context views it reads ("frame", "gray", "hsv", "diff", "time")
+    - history: how many previous frames it looks back on
+    - stateful: keeps state across frames, so it has to see every frame in
+      order (the process pool runs such detectors in the parent)
+    - cost: relative cost estimate, cheaper detectors run first
+    - defaults: default thresholds (and tuning knobs such as "tiles", the
+      rows x cols grid for tiled kernels, None picks one for this machine)
+    - enable_setting / settings: keys of the GUI settings dict that map to
+      the enable flag and to thresholds
+    """
+
+    name = None
+    label = None
+    inputs = ()
+    history = 0
+    stateful = False
+    cost = 1.0
+    defaults = {}
+    enable_setting = None
+    settings = {}
+
+    def __init__(self, enabled=True, **thresholds):
+        self.enabled = enabled
+        self.thresholds = dict(self.defaults)
+        self.configure(**thresholds)
+
+    def configure(self, **thresholds):
+        unknown = set(thresholds) - set(self.defaults)
+        if unknown:
+            raise ValueError(f"Unknown thresholds for {self.name}: {sorted(unknown)}")
+        self.thresholds.update(thresholds)
+
+    def apply_settings(self, settings):
+        """Pick the enable flag and thresholds out of a flat settings dict"""
+        if self.enable_setting in settings:
+            self.enabled = settings[self.enable_setting]
+        self.configure(**{key: settings[setting] for setting, key in self.settings.items()
+                          if setting in settings})
+
+    def detect(self, context, fps):
+        raise NotImplementedError
+
+
+@register_detector
+class FrameDropDetector(Detector):
+    """Interval between two frames is longer than expected"""
+
+    name = "frame_drop"
+    label = "Frame drop"
+    inputs = ("time",)
+    history = 1
+    cost = 0.0
+    defaults = {"threshold": 1.5}
+    enable_setting = "detect_frame_drops"
+    settings = {"frame_drop_threshold": "threshold"}
+
+    def detect(self, context, fps):
+        prev = context.prev
+        if prev is None:
+            return None
+
+        expected_interval = 1.0 / fps
+        actual_interval = context.time - prev.time
+        if actual_interval <= expected_interval * self.thresholds["threshold"]:
+            return None
+
+        frame_with_text = context.frame.copy()
+        text = f"Drop: {actual_interval:.4f}s vs expected {expected_interval:.4f}s"
+        cv2.putText(frame_with_text, text, (30, 60), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8, (0, 0, 255), 2)
+        return {
+            "details": f"Expected: {expected_interval:.4f}s, Actual: {actual_interval:.4f}s",
+            "message": f"Frame drop: {actual_interval:.4f}s",
+            "metric": actual_interval,
+            "frame": frame_with_text
+        }
+
+
+@register_detector
+class ColorDefectDetector(Detector):
+    """Blocks of defect colors, typical for broken chroma decoding or lost slices.
+
+    Every color is a (lower, upper) box in BGR space. Pixels are classified
+    against all boxes in one pass with per-channel lookup tables: each table
+    maps a channel value to the set of boxes it fits, and the three results
+    are AND-ed, so no HSV conversion is needed and the cost hardly grows
+    with the number of colors (up to 8). The tables are rebuilt only when "colors"
+    changes. A color is reported when it covers more than its "min_pixels"
+    entry, or "threshold" pixels if it has none.
+
+    Black blocks of lost slices would only be a pixel count as well, which
+    also fires on letterbox bars and dark scenes, so black is not among the
+    default colors. Add ((0, 0, 0), (8, 8, 8)) as "black" for sources
+    without them, "min_pixels" already has an entry for it.
+    """
+
+    name = "color_defects"
+    label = "Color defects"
+    inputs = ("frame",)
+    cost = 1.0
+    defaults = {
+        "colors": {
+            "green": ((0, 100, 0), (90, 255, 90)),
+            "magenta": ((100, 0, 100), (255, 90, 255))
+        },
+        "threshold": 100,
+        "min_pixels": {"black": 5000},
+        "tiles": None
+    }
+    enable_setting = "detect_color_defects"
+    settings = {"green_threshold": "threshold"}
+
+    def __init__(self, enabled=True, **thresholds):
+        self._luts = None
+        self._luts_colors = None
+        super().__init__(enabled, **thresholds)
+
+    def luts(self):
+        """Lookup tables for the current colors, built again only after they change"""
+        colors = self.thresholds["colors"]
+        if self._luts is None or colors != self._luts_colors:
+            self._luts = channel_luts(list(colors.values()))
+            self._luts_colors = dict(colors)
+        return self._luts
+
+    def detect(self, context, fps):
+        height, width = context.frame.shape[:2]
+        rows, cols = self.thresholds["tiles"] or default_tiles()
+        colors = self.thresholds["colors"]
+        mask, tiles = color_lut_tiles(context.frame, self.luts(), len(colors),
+                                      grid(height, width, rows, cols))
+        counts = dict(zip(colors, (int(count) for count in np.sum(tiles, axis=0))))
+        min_pixels = self.thresholds["min_pixels"]
+        found = {name: count for name, count in counts.items()
+                 if count > min_pixels.get(name, self.thresholds["threshold"])}
+        if not found:
+            return None
+
+        # Highlight the defect areas on a copy of the frame
+        bits = sum(1 << bit for bit, name in enumerate(colors) if name in found)
+        defect_mask = cv2.compare(cv2.bitwise_and(mask, bits), 0, cv2.CMP_GT)
+        frame_with_mask = context.frame.copy()
+        defect_areas = cv2.bitwise_and(frame_with_mask, frame_with_mask, mask=defect_mask)
+        alpha = 0.5
+        cv2.addWeighted(defect_areas, alpha, frame_with_mask, 1 - alpha, 0, frame_with_mask)
+        summary = ", ".join(f"{name} {count}" for name, count in found.items())
+        return {
+            "details": f"Detected defect color pixels: {summary}",
+            "message": f"Color defects: {summary}",
+            "metric": sum(found.values()),
+            "counts": counts,
+            "locations": [cv2.boundingRect(defect_mask)],
+            "frame": frame_with_mask
+        }
+
+
+@register_detector
+class TearingDetector(Detector):
+    """Large changed areas between consecutive frames.
+
+    A coarse pass on a downscaled pyramid level ("prescreen_level", 2 is 1/4
+    of the size, 0 disables it) flags the cells of a "prescreen_grid" that
+    changed at all. Only those cells get the full resolution diff and
+    threshold, so static content costs almost nothing. The coarse threshold
+    is the full one divided by the block size and flagged cells are widened
+    by a neighbour, so the coarse pass only decides where to look, not what
+    is reported.
+    """
+
+    name = "image_tearing"
+    label = "Image tearing"
+    inputs = ("gray", "diff")
+    history = 1
+    cost = 3.0
+    defaults = {"threshold": 30, "min_area": 500, "tiles": None,
+                "prescreen_level": 2, "prescreen_grid": (8, 8)}
+    enable_setting = "detect_tearing"
+    settings = {"tearing_threshold": "threshold", "tearing_min_area": "min_area"}
+
+    def detect(self, context, fps):
+        prev = context.prev
+        if prev is None:
+            return None
+
+        height, width = context.frame.shape[:2]
+        level = self.thresholds["prescreen_level"]
+        area = (0, height, 0, width)
+        if level:
+            # Coarse pass: the pyramid of the previous frame is already cached.
+            # A one pixel wide line over the threshold still moves its block
+            # average by threshold / block size
+            _, coarse = cv2.threshold(context.diff(level), max(self.thresholds["threshold"] >> level, 1),
+                                      255, cv2.THRESH_BINARY)
+            rows, cols = self.thresholds["prescreen_grid"]
+            flags = flag_cells(coarse, rows, cols)
+            if not flags.any():
+                return None
+            cells = [cell for cell, flag in zip(grid(height, width, rows, cols), flags.ravel()) if flag]
+            # Contours are only searched inside the flagged area
+            area = (min(c[0] for c in cells), max(c[1] for c in cells),
+                    min(c[2] for c in cells), max(c[3] for c in cells))
+        else:
+            rows, cols = self.thresholds["tiles"] or default_tiles()
+            cells = grid(height, width, rows, cols)
+
+        # absdiff + threshold run tile by tile, contours need the whole mask
+        thresh, tiles = diff_threshold_tiles(prev.gray, context.gray, self.thresholds["threshold"],
+                                             cells)
+        changed_pixels, locations = reduce_tiles(tiles)
+        if not changed_pixels:
+            return None
+
+        y0, y1, x0, x1 = area
+        contours, _ = cv2.findContours(np.ascontiguousarray(thresh[y0:y1, x0:x1]), cv2.RETR_EXTERNAL,
+                                       cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
+        large_contours = [c for c in contours if cv2.contourArea(c) > self.thresholds["min_area"]]
+        if not large_contours:
+            return None
+
+        frame_with_contours = context.frame.copy()
+        cv2.drawContours(frame_with_contours, large_contours, -1, (0, 0, 255), 2)
+        return {
+            "details": f"Detected {len(large_contours)} potential tears",
+            "message": f"Image tearing: {len(large_contours)} areas",
+            "metric": len(large_contours),
+            "locations": locations,
+            "frame": frame_with_contours
+        }
+
+
+@register_detector
+class TearLineDetector(Detector):
+    """Horizontal seam where one frame shows two consecutive source frames.
+
+    A torn frame M has its top rows from the frame before it (A) and its
+    bottom rows from the frame after it (B). Per-row mean differences of M
+    against A and B are reduced to one profile each, and the best seam row
+    is found for all candidates at once from cumulative sums. The tear is
+    reported when, on each side of the seam, M matches one neighbour
+    ("match_threshold") and clearly differs from the other one
+    ("change_threshold"), both in mean gray levels per pixel.
+
+    The check runs one frame behind: when frame N arrives, frame N-1 is the
+    candidate, so incidents carry the index and time of frame N-1.
+    """
+
+    name = "tear_line"
+    label = "Tear line"
+    inputs = ("gray",)
+    history = 2
+    cost = 0.5
+    defaults = {"match_threshold": 1.0, "change_threshold": 3.0, "min_rows": 8, "level": 1}
+    enable_setting = "detect_tear_line"
+
+    def detect(self, context, fps):
+        middle = context.prev
+        before = middle.prev if middle is not None else None
+        if before is None:
+            return None
+
+        # Row profiles on a downscaled level, one mean per row
+        level = self.thresholds["level"]
+        m = middle.pyramid(level)
+        to_before = cv2.absdiff(m, before.pyramid(level)).mean(axis=1)
+        to_after = cv2.absdiff(m, context.pyramid(level)).mean(axis=1)
+
+        rows = len(to_before)
+        min_rows = max(self.thresholds["min_rows"] >> level, 1)
+        if rows <= 2 * min_rows:
+            return None
+
+        # For a seam at row y: rows above it compared with A, rows from y on with B
+        top = np.concatenate(([0.0], np.cumsum(to_before)))
+        bottom = np.concatenate((np.cumsum(to_after[::-1])[::-1], [0.0]))
+        candidates = np.arange(min_rows, rows - min_rows + 1)
+        seam = int(candidates[np.argmin(top[candidates] + bottom[candidates])])
+
+        top_match = top[seam] / seam
+        bottom_match = bottom[seam] / (rows - seam)
+        if max(top_match, bottom_match) > self.thresholds["match_threshold"]:
+            return None
+
+        # The other neighbour has to differ on both sides, otherwise M is
+        # simply a repeat of A or B (or the content is static)
+        top_change = to_after[:seam].mean()
+        bottom_change = to_before[seam:].mean()
+        if min(top_change, bottom_change) < self.thresholds["change_threshold"]:
+            return None
+
+        y = seam << level
+        frame_with_line = middle.frame.copy()
+        cv2.line(frame_with_line, (0, y), (frame_with_line.shape[1] - 1, y), (0, 0, 255), 2)
+        return {
+            "details": f"Tear line at y={y} (match {max(top_match, bottom_match):.2f}, "
+                       f"change {min(top_change, bottom_change):.2f})",
+            "message": f"Tear line: y={y}",
+            "metric": y,
+            "locations": [(0, y, int(frame_with_line.shape[1]), 1)],
+            "time": middle.time,
+            "index": middle.index,
+            "frame": frame_with_line
+        }
+
+
+@register_detector
+class FrozenFrameDetector(Detector):
+    """Consecutive captures showing the same source frame.
+
+    Frames are compared on a sparse grid of about "samples" pixels per row:
+    the mean difference of each cell of a rows x cols "grid" must stay
+    within "tolerance" gray levels for the frame to count as a repeat, so
+    codec noise is ignored but any real motion is not. Noise averages out
+    over the whole grid while a slow fade moves every cell the same way,
+    so the mean signed difference must also stay within "max_shift"; a
+    fade of one level per frame is motion, not a frozen picture. This
+    costs a small fraction of a millisecond even for 1080p.
+
+    Repeats that last "freeze_time" seconds are reported as a frozen
+    picture. Otherwise the effective source frame rate (distinct frames per
+    second over the last "window" seconds) is reported when it falls below
+    "min_fps_ratio" of "source_fps" (the analysis fps when None).
+
+    Both findings share one metric, the share of repeated frames (1 minus
+    effective over expected rate, 1.0 for a frozen picture), so events and
+    metric columns compare severities in one unit.
+    """
+
+    name = "frozen_frames"
+    label = "Frozen frames"
+    inputs = ("frame", "time")
+    history = 1
+    stateful = True
+    cost = 0.1
+    defaults = {"tolerance": 1.0, "max_shift": 0.25, "grid": (9, 16), "samples": 240,
+                "freeze_time": 0.5, "window": 2.0, "source_fps": None, "min_fps_ratio": 0.9}
+    enable_setting = "detect_frozen_frames"
+
+    def __init__(self, enabled=True, **thresholds):
+        super().__init__(enabled, **thresholds)
+        self.repeated = 0
+        self.effective_fps = None
+        self._frozen_since = None
+        self._distinct = collections.deque()
+        self._lock = threading.Lock()
+
+    def detect(self, context, fps):
+        prev = context.prev
+        with self._lock:
+            if prev is None:
+                self._frozen_since = None
+                self._distinct.clear()
+                self._distinct.append(context.time)
+                return None
+
+            step = max(context.frame.shape[1] // self.thresholds["samples"], 1)
+            rows, cols = self.thresholds["grid"]
+            diff = cv2.subtract(context.sample(step), prev.sample(step), dtype=cv2.CV_32F)
+            cells = cv2.resize(diff, (cols, rows), interpolation=cv2.INTER_AREA)
+            if np.abs(cells).max() <= self.thresholds["tolerance"] and \
+                    abs(float(cells.mean())) <= self.thresholds["max_shift"]:
+                self.repeated += 1
+                if self._frozen_since is None:
+                    self._frozen_since = prev.time
+            else:
+                self._frozen_since = None
+                self._distinct.append(context.time)
+
+            window = self.thresholds["window"]
+            while self._distinct and context.time - self._distinct[0] > window:
+                self._distinct.popleft()
+            # Only a window that is full says anything about the rate
+            self.effective_fps = None
+            if self._distinct and context.time - self._distinct[0] >= window * 0.9:
+                self.effective_fps = len(self._distinct) / window
+
+            frozen_for = context.time - self._frozen_since if self._frozen_since is not None else 0.0
+            expected = self.thresholds["source_fps"] or fps
+            if frozen_for >= self.thresholds["freeze_time"]:
+                details = f"Same frame for {frozen_for:.2f}s"
+                message = f"Frozen picture: {frozen_for:.2f}s"
+                metric = 1.0
+            elif self.effective_fps is not None and \
+                    self.effective_fps < expected * self.thresholds["min_fps_ratio"]:
+                details = (f"Effective source rate {self.effective_fps:.1f} FPS, expected {expected:.1f} "
+                           f"({self.repeated} repeated frames so far)")
+                message = f"Repeated frames: {self.effective_fps:.1f} FPS"
+                metric = round(1.0 - self.effective_fps / expected, 3)
+            else:
+                return None
+
+        frame_with_text = context.frame.copy()
+        cv2.putText(frame_with_text, message, (30, 60), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.8, (0, 0, 255), 2)
+        return {
+            "details": details,
+            "message": message,
+            "metric": metric,
+            "effective_fps": self.effective_fps,
+            "frozen_for": frozen_for,
+            "frame": frame_with_text
+        }
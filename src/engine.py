@@ -0,0 +1,169 @@
+import collections
+import datetime
+import threading
+import time
+from detectors import DETECTORS, create_detector
+from histogram import LatencyStats
+
+
+class DetectionEngine:
+    """Runs a set of registered detectors over buffered frames.
+
+    Every front-end (Tk and Qt GUIs, console tools) feeds FrameContexts into
+    one engine and reads incidents back from `report`, so detector logic and
+    thresholds live in one place.
+
+    With a `writer` (an IncidentWriter) every incident is also streamed to
+    disk, `report_limit` caps how many recent incidents stay in memory and
+    `incident_count` keeps the total. Their frames then live on disk only,
+    the in-memory copies drop them. With an
+    `aggregator` (an EventAggregator) runs of incidents are merged first:
+    closed events go to `events` and to the writer instead of incidents.
+    With `metrics` (a FrameMetrics) the metric of every detector is also
+    kept per frame.
+
+    `latency` (a LatencyStats) holds histograms of the time each detector
+    takes, of the processing latency of whole frames ("frame") and of
+    handing incidents to the writer; capture loops add the interval between
+    frames ("interval") and their own stages.
+    """
+
+    def __init__(self, fps=30, detectors=None, offline=False, writer=None, report_limit=None,
+                 aggregator=None, metrics=None):
+        self.fps = fps
+        self.offline = offline
+        self.detectors = [create_detector(name) for name in (detectors or DETECTORS)]
+        self.detectors.sort(key=lambda detector: detector.cost)
+        self.writer = writer
+        self.report_limit = report_limit
+        self.report = collections.deque(maxlen=report_limit)
+        self.incident_count = 0
+        self.aggregator = aggregator
+        self.metrics = metrics
+        self.events = collections.deque(maxlen=report_limit)
+        self.event_count = 0
+        self.latency = LatencyStats()
+        self._lock = threading.Lock()
+
+    @property
+    def history(self):
+        """Previous frames the enabled detectors look back on"""
+        return max([detector.history for detector in self.detectors if detector.enabled], default=0)
+
+    def detector(self, name):
+        for detector in self.detectors:
+            if detector.name == name:
+                return detector
+        raise KeyError(name)
+
+    def configure(self, name, enabled=None, **thresholds):
+        """Enable/disable one detector and update its thresholds"""
+        detector = self.detector(name)
+        if enabled is not None:
+            detector.enabled = enabled
+        detector.configure(**thresholds)
+
+    def apply_settings(self, settings):
+        """Apply a flat settings dict as used by the Qt GUI"""
+        if "fps" in settings:
+            self.fps = settings["fps"]
+        for detector in self.detectors:
+            detector.apply_settings(settings)
+
+    def incident_timestamp(self, frame_time):
+        """Wall clock time for live capture, stream position for offline sources"""
+        if self.offline:
+            return f"{frame_time:.3f}s"
+        return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def stamp(self, incident, detector, frame_time, index):
+        """Add the fields every incident carries.
+
+        Detectors reporting on an earlier frame set "time" and "index"
+        themselves.
+        """
+        incident.setdefault("time", frame_time)
+        incident.setdefault("index", index)
+        incident.update({
+            "timestamp": self.incident_timestamp(incident["time"]),
+            "type": detector.name,
+            "label": detector.label
+        })
+        return incident
+
+    def record(self, incidents, index=None, frame_time=None):
+        """Append the incidents of frame `index` to the report and hand them on.
+
+        Frames without incidents are recorded too when events are
+        aggregated or metrics kept, that is how open events learn they
+        have ended.
+        """
+        if self.aggregator is None and self.metrics is None and not incidents:
+            return
+
+        events = incidents
+        with self._lock:
+            self.report.extend(self.kept(incidents))
+            self.incident_count += len(incidents)
+            if self.metrics is not None and index is not None:
+                self.metrics.add(index, frame_time, incidents)
+            if self.aggregator is not None:
+                events = self.aggregator.update(index, incidents)
+                self.events.extend(self.kept(events))
+                self.event_count += len(events)
+        self.write(events)
+
+    def finish(self):
+        """Close the events still open, at the end of a source"""
+        if self.aggregator is None:
+            return
+        with self._lock:
+            events = self.aggregator.close()
+            self.events.extend(self.kept(events))
+            self.event_count += len(events)
+        self.write(events)
+
+    def kept(self, items):
+        """What `report` and `events` keep of `items`: without frames once a writer saves them"""
+        if self.writer is None:
+            return items
+        return [{key: value for key, value in item.items() if key not in ("frame", "frames")}
+                for item in items]
+
+    def write(self, items):
+        if self.writer is not None and items:
+            # Includes the frame copies and waiting for the writer queue
+            with self.latency.stage("report.write"):
+                for item in items:
+                    self.writer.write(item)
+
+    def detect(self, context, detectors=None):
+        """Run enabled detectors (all by default) on one frame, return stamped incidents"""
+        incidents = []
+        for detector in detectors or self.detectors:
+            if not detector.enabled:
+                continue
+            start = time.perf_counter()
+            incident = detector.detect(context, self.fps)
+            self.latency.record("detect." + detector.name, time.perf_counter() - start)
+            if incident is not None:
+                incidents.append(self.stamp(incident, detector, context.time, context.index))
+        return incidents
+
+    def process(self, context):
+        """Run all enabled detectors on one frame and return the new incidents"""
+        start = time.perf_counter()
+        incidents = self.detect(context)
+        self.latency.record("frame", time.perf_counter() - start)
+        self.record(incidents, context.index, context.time)
+        return incidents
+
+    def reset(self):
+        with self._lock:
+            self.report = collections.deque(maxlen=self.report_limit)
+            self.incident_count = 0
+            self.events = collections.deque(maxlen=self.report_limit)
+            self.event_count = 0
+            self.latency.reset()
+            if self.aggregator is not None:
+                self.aggregator.open = {}
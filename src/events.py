@@ -0,0 +1,81 @@
+class EventAggregator:
+    """Merges runs of same-type incidents into time-ranged events.
+
+    A defect that lasts for seconds fires on every frame. Instead of one
+    incident (and one saved frame) per frame, consecutive incidents of a
+    type are folded into one open event that keeps start/end, the number
+    of frames, peak and mean metric and only three frames: first, peak and
+    last. An event closes once no incident of its type arrived for more
+    than `max_gap` frames, or when `close()` is called at the end.
+    """
+
+    def __init__(self, max_gap=2):
+        self.max_gap = max_gap
+        self.open = {}
+
+    def update(self, index, incidents):
+        """Fold the incidents of frame `index` in, return events that closed"""
+        for incident in incidents:
+            event = self.open.get(incident["type"])
+            if event is None:
+                self.open[incident["type"]] = self._start(incident)
+            else:
+                self._extend(event, incident)
+
+        closed = [event for event in self.open.values()
+                  if index - event["end_index"] > self.max_gap]
+        for event in closed:
+            del self.open[event["type"]]
+        return [self._finish(event) for event in closed]
+
+    def close(self):
+        """Close all open events, e.g. when the source ends"""
+        closed, self.open = list(self.open.values()), {}
+        return [self._finish(event) for event in closed]
+
+    def _start(self, incident):
+        frame = incident.get("frame")
+        return {
+            "type": incident["type"],
+            "label": incident["label"],
+            "time": incident["time"],
+            "index": incident["index"],
+            "timestamp": incident["timestamp"],
+            "end_time": incident["time"],
+            "end_index": incident["index"],
+            "end_timestamp": incident["timestamp"],
+            "count": 1,
+            "metric_sum": float(incident["metric"]),
+            "peak": incident["metric"],
+            "peak_index": incident["index"],
+            "peak_details": incident["details"],
+            "frames": {"first": frame, "peak": frame, "last": frame}
+        }
+
+    def _extend(self, event, incident):
+        # Detector threads can finish frames slightly out of order
+        if incident["index"] >= event["end_index"]:
+            event.update({
+                "end_time": incident["time"],
+                "end_index": incident["index"],
+                "end_timestamp": incident["timestamp"]
+            })
+            event["frames"]["last"] = incident.get("frame")
+        event["count"] += 1
+        event["metric_sum"] += float(incident["metric"])
+        if incident["metric"] > event["peak"]:
+            event.update({
+                "peak": incident["metric"],
+                "peak_index": incident["index"],
+                "peak_details": incident["details"]
+            })
+            event["frames"]["peak"] = incident.get("frame")
+
+    def _finish(self, event):
+        event["mean"] = event.pop("metric_sum") / event["count"]
+        event["duration"] = event["end_time"] - event["time"]
+        event["details"] = (f"{event['count']} frames from {event['timestamp']} to "
+                            f"{event['end_timestamp']}, peak {event['peak']}, "
+                            f"mean {event['mean']:.2f} ({event['peak_details']})")
+        event["message"] = f"{event['label']}: {event['count']} frames"
+        return event
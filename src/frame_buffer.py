@@ -0,0 +1,245 @@
+import threading
+import time
+import cv2
+import numpy as np
+
+
+class FrameContext:
+    """Derived views of one buffered frame, each computed at most once.
+
+    Detectors ask the context for the gray, HSV, pyramid or difference image
+    instead of converting the frame themselves. The previous frame's context
+    comes from the ring buffer, so the gray image of frame N is reused when
+    frame N+1 is compared against it. When the ring buffer has a `latency`
+    (a LatencyStats) every conversion is timed as "convert.<view>".
+    """
+
+    def __init__(self, ring, index):
+        self.ring = ring
+        self.index = index
+        self.frame = ring.frame(index)
+        self.time = ring.time(index)
+        self.gap = bool(ring.gaps[index % ring.capacity])
+        self._cache = {}
+        self._lock = threading.RLock()
+
+    def _get(self, key, compute):
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                latency = self.ring.latency
+                if latency is None:
+                    value = compute()
+                else:
+                    start = time.perf_counter()
+                    value = compute()
+                    name = key if isinstance(key, str) else key[0]
+                    latency.record("convert." + name, time.perf_counter() - start)
+                self._cache[key] = value
+            return value
+
+    @property
+    def prev(self):
+        """Context of the previous frame, None if it is not buffered or frames were skipped"""
+        if self.gap or not self.ring.contains(self.index - 1):
+            return None
+        return self.ring.context(self.index - 1)
+
+    @property
+    def gray(self):
+        return self._get("gray", lambda: cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY))
+
+    @property
+    def hsv(self):
+        return self._get("hsv", lambda: cv2.cvtColor(self.frame, cv2.COLOR_BGR2HSV))
+
+    def pyramid(self, level):
+        """Gray image downscaled `level` times by 2 (level 0 is full resolution).
+
+        Levels are area averaged straight from the full image, so every
+        pixel contributes and a thin change still shows up, scaled down by
+        the block size, wherever it falls. That is much cheaper than a
+        Gaussian pyrDown chain.
+        """
+        if level == 0:
+            return self.gray
+        height, width = self.frame.shape[:2]
+        size = (max(width >> level, 1), max(height >> level, 1))
+        return self._get(("pyramid", level),
+                         lambda: cv2.resize(self.gray, size, interpolation=cv2.INTER_AREA))
+
+    def sample(self, step):
+        """About every `step`-th pixel in both directions, a cheap stand-in for the whole frame"""
+        height, width = self.frame.shape[:2]
+        size = (max(width // step, 1), max(height // step, 1))
+        # Nearest neighbour picks single pixels, much faster than strided slicing
+        return self._get(("sample", step),
+                         lambda: cv2.resize(self.frame, size, interpolation=cv2.INTER_NEAREST))
+
+    def diff(self, level=0):
+        """Absolute gray difference to the previous frame, None for the first frame"""
+        prev = self.prev
+        if prev is None:
+            return None
+        return self._get(("diff", level), lambda: cv2.absdiff(prev.pyramid(level), self.pyramid(level)))
+
+
+class FrameRingBuffer:
+    """Fixed-capacity frame history backed by one preallocated array.
+
+    Frames live in a single (capacity, height, width, channels) uint8 array
+    with a parallel float64 array of timestamps. Sources write straight into
+    the next slot, so storing a frame costs no allocation and no copy.
+
+    Frames are addressed by their absolute index (`start`, 0 by default, for
+    the first frame ever written). Pass `buffer` (e.g. a shared memory block) to place the frame
+    array in memory owned by someone else. Slots can be pinned while another thread is still reading
+    them; `writable()` tells the writer whether the next slot is free.
+    """
+
+    def __init__(self, capacity, height, width, channels=3, buffer=None, start=0):
+        self.capacity = capacity
+        shape = (capacity, height, width, channels)
+        if buffer is None:
+            self.frames = np.zeros(shape, dtype=np.uint8)
+        else:
+            self.frames = np.ndarray(shape, dtype=np.uint8, buffer=buffer)
+        self.times = np.full(capacity, np.nan, dtype=np.float64)
+        self.gaps = np.zeros(capacity, dtype=bool)
+        # Continuing the numbering of an earlier buffer keeps indices unique
+        self.start = start
+        self.count = start
+        self.latency = None  # LatencyStats timing the FrameContext conversions
+        self._contexts = [None] * capacity
+        self._pins = np.zeros(capacity, dtype=np.int32)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    @property
+    def shape(self):
+        return self.frames.shape[1:]
+
+    def next_slot(self):
+        """Array the next frame should be written into"""
+        return self.frames[self.count % self.capacity]
+
+    def commit(self, timestamp, gap=False):
+        """Mark the next slot as written and return its frame index.
+
+        `gap` marks that frames were skipped right before this one, so it
+        must not be compared with the previous buffered frame.
+        """
+        index = self.count
+        self.times[index % self.capacity] = timestamp
+        self.gaps[index % self.capacity] = gap
+        self.count += 1
+        return index
+
+    def capture(self, source, gap=False):
+        """Read one frame from `source` directly into the next slot.
+
+        Returns the frame index, or None when the source is exhausted.
+        `gap` is passed on to commit().
+        """
+        frame, timestamp = source.read(out=self.next_slot())
+        if frame is None:
+            return None
+        return self.commit(timestamp, gap=gap)
+
+    def contains(self, index):
+        """True if frame `index` is still held in the buffer"""
+        return index is not None and self.start <= index < self.count and index >= self.count - self.capacity
+
+    def frame(self, index):
+        """Frame by absolute index"""
+        if not self.contains(index):
+            raise IndexError(f"Frame {index} is not in the buffer")
+        return self.frames[index % self.capacity]
+
+    def time(self, index):
+        """Timestamp by absolute index"""
+        if not self.contains(index):
+            raise IndexError(f"Frame {index} is not in the buffer")
+        return float(self.times[index % self.capacity])
+
+    def context(self, index):
+        """Shared FrameContext for frame `index`"""
+        if not self.contains(index):
+            raise IndexError(f"Frame {index} is not in the buffer")
+        with self._lock:
+            slot = index % self.capacity
+            context = self._contexts[slot]
+            if context is None or context.index != index:
+                context = FrameContext(self, index)
+                self._contexts[slot] = context
+            return context
+
+    def history(self, index, depth):
+        """Frame `index` and up to `depth` directly preceding frames, newest first.
+
+        Stops early at a gap or at frames that are no longer buffered.
+        """
+        indices = [index]
+        while len(indices) <= depth:
+            current = indices[-1]
+            if self.gaps[current % self.capacity] or not self.contains(current - 1):
+                break
+            indices.append(current - 1)
+        return indices
+
+    def latest(self, age=0):
+        """Absolute index of the newest frame (age=0) or an older one, None if not held"""
+        index = self.count - 1 - age
+        return index if self.contains(index) else None
+
+    def pin(self, *indices):
+        """Protect frames from being overwritten until they are released"""
+        with self._lock:
+            for index in indices:
+                if index is not None:
+                    self._pins[index % self.capacity] += 1
+
+    def release(self, *indices):
+        with self._lock:
+            for index in indices:
+                if index is not None:
+                    self._pins[index % self.capacity] -= 1
+
+    def writable(self):
+        """True if the next slot is not pinned by a reader"""
+        with self._lock:
+            return self._pins[self.count % self.capacity] == 0
+
+
+class RegionRingBuffer(FrameRingBuffer):
+    """A rectangle of every frame of another ring buffer, without copies.
+
+    Frames are numpy views into the parent's array, while timestamps,
+    gaps, the frame count and pins are the parent's own, so whatever is
+    captured into the parent shows up here at once. The region keeps its
+    own FrameContexts, so gray images, diffs etc. are computed for the
+    rectangle only. Capture into the parent, not into the region.
+    """
+
+    def __init__(self, parent, x1, y1, x2, y2):
+        height, width = parent.frames.shape[1:3]
+        if not (0 <= x1 < x2 <= width and 0 <= y1 < y2 <= height):
+            raise ValueError(f"Region ({x1}, {y1}, {x2}, {y2}) is outside the {width}x{height} frame")
+        self.parent = parent
+        self.rect = (x1, y1, x2, y2)
+        self.capacity = parent.capacity
+        self.frames = parent.frames[:, y1:y2, x1:x2]
+        self.latency = parent.latency
+        self._contexts = [None] * self.capacity
+
+    times = property(lambda self: self.parent.times)
+    gaps = property(lambda self: self.parent.gaps)
+    count = property(lambda self: self.parent.count)
+    start = property(lambda self: self.parent.start)
+    _pins = property(lambda self: self.parent._pins)
+    _lock = property(lambda self: self.parent._lock)
+
+    def commit(self, timestamp, gap=False):
+        raise TypeError("Frames are committed to the parent ring buffer")
@@ -0,0 +1,234 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# mss grabs the screen straight through Xlib (XGetImage on Linux, no MIT-SHM
+# in the pinned 9.0.1) and hands back raw BGRA bytes, so no PIL image is
+# ever built
+try:
+    import mss
+except ImportError:
+    mss = None
+
+# pyautogui needs a display at import time, it is only a fallback
+try:
+    import pyautogui
+except Exception:
+    pyautogui = None
+
+
+class FrameSource:
+    """Base class for everything that produces BGR frames"""
+
+    # Live sources have to be paced by the caller, offline ones can run
+    # as fast as the detectors allow
+    realtime = True
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.fps = None
+        self.latency = None  # LatencyStats for the stages of a read, if the source has any
+
+    def read(self, out=None):
+        """Return (frame, timestamp), or (None, None) when the source is exhausted.
+
+        The returned frame is a buffer owned by the source and is overwritten
+        by the next read. Pass `out` to have the frame written into your own
+        (height, width, 3) uint8 array instead.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release the underlying device or file"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ScreenFrameSource(FrameSource):
+    """Grab a screen region, via mss when available and pyautogui otherwise.
+
+    With `latency` set, the grab and the color conversion are timed as
+    "capture.grab" and "capture.convert".
+    """
+
+    def __init__(self, region, channels=3, backend=None):
+        super().__init__()
+        x1, y1, x2, y2 = region
+        self.region = tuple(region)
+        self.width, self.height = x2 - x1, y2 - y1
+        self.channels = channels
+        self._monitor = {"left": x1, "top": y1, "width": self.width, "height": self.height}
+        self._buffer = np.empty((self.height, self.width, channels), dtype=np.uint8)
+        self._sct = None
+        self._grabber = None
+
+        if backend is None:
+            backend = "mss" if mss is not None else "pyautogui"
+        if backend == "mss" and mss is None:
+            raise RuntimeError("mss is not installed")
+        if backend == "pyautogui" and pyautogui is None:
+            raise RuntimeError("pyautogui is not available (no display?)")
+        self.backend = backend
+
+    def read(self, out=None):
+        if out is None:
+            out = self._buffer
+
+        start = time.perf_counter()
+        if self.backend == "mss":
+            # mss keeps its X display handle in a threading.local, usable only
+            # by the thread that opened it. Callers may read from any thread
+            # (a shared pool, say), so every grab runs on one thread of our own
+            if self._grabber is None:
+                self._grabber = ThreadPoolExecutor(1, thread_name_prefix="mss")
+            shot = self._grabber.submit(self._grab).result()
+            grabbed = time.perf_counter()
+            bgra = np.frombuffer(shot.raw, dtype=np.uint8).reshape(self.height, self.width, 4)
+            if self.channels == 4:
+                np.copyto(out, bgra)
+            else:
+                cv2.cvtColor(bgra, cv2.COLOR_BGRA2BGR, dst=out)
+        else:
+            x1, y1 = self.region[:2]
+            screenshot = pyautogui.screenshot(region=(x1, y1, self.width, self.height))
+            grabbed = time.perf_counter()
+            code = cv2.COLOR_RGB2BGRA if self.channels == 4 else cv2.COLOR_RGB2BGR
+            cv2.cvtColor(np.asarray(screenshot), code, dst=out)
+
+        # Monotonic, so frame intervals survive wall clock adjustments
+        now = time.perf_counter()
+        if self.latency is not None:
+            self.latency.record("capture.grab", grabbed - start)
+            self.latency.record("capture.convert", now - grabbed)
+        return out, now
+
+    def _grab(self):
+        if self._sct is None:
+            self._sct = mss.mss()
+        return self._sct.grab(self._monitor)
+
+    def _close_sct(self):
+        if self._sct is not None:
+            self._sct.close()
+            self._sct = None
+
+    def close(self):
+        # The handle is closed on the thread that opened it
+        if self._grabber is not None:
+            self._grabber.submit(self._close_sct).result()
+            self._grabber.shutdown()
+            self._grabber = None
+
+
+class VideoFileFrameSource(FrameSource):
+    """Decode a recorded stream with OpenCV, timestamps come from the container PTS"""
+
+    realtime = False
+
+    def __init__(self, path, loop=False):
+        super().__init__()
+        self.path = path
+        self.loop = loop
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"Cannot open video file: {path}")
+
+        self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or None
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self._buffer = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        self._time_offset = 0.0
+        self._last_time = 0.0
+
+    def read(self, out=None):
+        if out is None:
+            out = self._buffer
+
+        ok, frame = self.capture.read(out)
+        if not ok and self.loop:
+            # Keep timestamps monotonic across loops
+            self._time_offset = self._last_time + (1.0 / self.fps if self.fps else 0.0)
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read(out)
+        if not ok:
+            return None, None
+
+        timestamp = self._time_offset + self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+        self._last_time = timestamp
+        return frame, timestamp
+
+    def close(self):
+        self.capture.release()
+
+
+class SyntheticFrameSource(FrameSource):
+    """Generate test patterns, for running without any display or video file"""
+
+    realtime = False
+    patterns = ["moving_bar", "gradient", "noise", "static"]
+
+    def __init__(self, width=640, height=480, fps=30, pattern="moving_bar", frames=None, seed=0):
+        super().__init__()
+        if pattern not in self.patterns:
+            raise ValueError(f"Unknown pattern '{pattern}', choose from {self.patterns}")
+        self.width, self.height = width, height
+        self.fps = fps
+        self.pattern = pattern
+        self.frames = frames
+        self.index = 0
+        self._rng = np.random.default_rng(seed)
+        self._buffer = np.empty((height, width, 3), dtype=np.uint8)
+
+        # Precompute the background once, patterns only move it around
+        ramp = np.linspace(0, 255, width, dtype=np.uint8)
+        self._background = np.empty((height, width, 3), dtype=np.uint8)
+        self._background[:] = ramp[None, :, None]
+
+    def render(self, index, out):
+        """Draw frame number `index` into `out`"""
+        if self.pattern == "noise":
+            out[:] = self._rng.integers(0, 256, out.shape, dtype=np.uint8)
+        elif self.pattern == "gradient":
+            np.copyto(out, np.roll(self._background, index * 4, axis=1))
+        elif self.pattern == "moving_bar":
+            np.copyto(out, self._background)
+            bar_width = max(self.width // 20, 1)
+            x = (index * 8) % self.width
+            out[:, x:x + bar_width] = 255
+        else:
+            np.copyto(out, self._background)
+        return out
+
+    def read(self, out=None):
+        if self.frames is not None and self.index >= self.frames:
+            return None, None
+        if out is None:
+            out = self._buffer
+
+        self.render(self.index, out)
+        timestamp = self.index / float(self.fps)
+        self.index += 1
+        return out, timestamp
+
+
+def open_frame_source(source, region=None, fps=30):
+    """Create a frame source from a short description.
+
+    `source` is "screen", "synthetic" / "synthetic:<pattern>" or a path to a
+    video file. `region` is (x1, y1, x2, y2); for synthetic sources only its
+    size is used.
+    """
+    if source == "screen":
+        return ScreenFrameSource(region)
+    if source.startswith("synthetic"):
+        pattern = source.partition(":")[2] or "moving_bar"
+        x1, y1, x2, y2 = region or (0, 0, 640, 480)
+        return SyntheticFrameSource(x2 - x1, y2 - y1, fps=fps, pattern=pattern)
+    return VideoFileFrameSource(source)
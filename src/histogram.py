@@ -0,0 +1,157 @@
+import math
+import threading
+import time
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """Fixed-memory histogram of durations with log-sized buckets (HDR style).
+
+    Values are counted in units of `resolution` seconds. Values below
+    2**bits units get a bucket each; above that every power of two is split
+    into 2**(bits - 1) buckets, so any value is kept with a relative error
+    below 2**-(bits - 1) (under 2% with the default 7 bits) while the bucket
+    count only grows with the logarithm of `highest`. Recording is a couple
+    of integer operations and one array increment, so it can stay on all
+    the time. Values above `highest` land in the last bucket, the exact
+    maximum is kept separately.
+    """
+
+    def __init__(self, highest=60.0, resolution=1e-6, bits=7):
+        self.resolution = resolution
+        self.bits = bits
+        self.sub_count = 1 << bits
+        self.half_count = self.sub_count >> 1
+        self.highest_units = max(int(highest / resolution), self.sub_count)
+        self.counts = np.zeros(self._bucket(self.highest_units) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def _bucket(self, units):
+        if units < self.sub_count:
+            return units
+        shift = units.bit_length() - self.bits
+        return self.sub_count + (shift - 1) * self.half_count + (units >> shift) - self.half_count
+
+    def _upper(self, bucket):
+        """Highest value in seconds that falls into `bucket`"""
+        if bucket < self.sub_count:
+            return bucket * self.resolution
+        shift, sub = divmod(bucket - self.sub_count, self.half_count)
+        shift += 1
+        return (((sub + self.half_count + 1) << shift) - 1) * self.resolution
+
+    def record(self, seconds):
+        units = min(max(int(seconds / self.resolution), 0), self.highest_units)
+        bucket = self._bucket(units)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def merge(self, other):
+        """Add the samples of a histogram with the same layout"""
+        with self._lock:
+            self.counts += other.counts
+            self.count += other.count
+            self.total += other.total
+            self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Value below which `percent` of the samples lie, in seconds"""
+        if not self.count:
+            return 0.0
+        rank = max(math.ceil(percent / 100.0 * self.count), 1)
+        bucket = int(np.searchsorted(np.cumsum(self.counts), rank))
+        return min(self._upper(bucket), self.max)
+
+    def summary(self):
+        """count, total, mean, p50/p95/p99 and max, times in seconds"""
+        with self._lock:
+            summary = {"count": self.count, "total": self.total,
+                       "mean": self.total / self.count if self.count else 0.0}
+            for percent in PERCENTILES:
+                summary[f"p{percent}"] = self.percentile(percent)
+            summary["max"] = self.max
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self.counts[:] = 0
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+
+class _Stage:
+    """Context manager adding the time spent in its block to a histogram"""
+
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.record(self.name, time.perf_counter() - self.start)
+
+
+class LatencyStats:
+    """Named LatencyHistograms, created on first use.
+
+    The engine keeps "interval" (time between consecutive frames), "frame"
+    (processing latency of a frame) and the stages of the frame loop:
+    "capture", "convert.<view>" for FrameContext conversions,
+    "detect.<detector>", "preview", "report.write" and "report.encode".
+    Streams of a multi-stream session add "lag", how late their frames are
+    taken after the deadline.
+    """
+
+    def __init__(self, **options):
+        self.options = options
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram(**self.options))
+        return histogram
+
+    def record(self, name, seconds):
+        self.histogram(name).record(seconds)
+
+    def stage(self, name):
+        """`with stats.stage("capture"): ...` times the block"""
+        return _Stage(self, name)
+
+    def summary(self):
+        return {name: histogram.summary() for name, histogram in list(self.histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+
+def format_summary(name, summary):
+    """One line like 'frame: p50 1.2 ms, p95 ..., max ... (n=100)'"""
+    values = ", ".join(f"p{percent} {summary[f'p{percent}'] * 1000:.1f}" for percent in PERCENTILES)
+    return f"{name}: {values}, max {summary['max'] * 1000:.1f} ms (n={summary['count']})"
+
+
+def summary_lines(summary):
+    """Formatted lines of a LatencyStats summary, interval and frame first"""
+    names = [name for name in ("interval", "frame") if name in summary]
+    names += sorted(name for name in summary if name not in ("interval", "frame"))
+    return [format_summary(name, summary[name]) for name in names]
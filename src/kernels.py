@@ -0,0 +1,146 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+# OpenCV releases the GIL inside its calls, so plain threads scale over tiles
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def tile_pool():
+    """Thread pool shared by all tile kernels of this process"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1,
+                                       thread_name_prefix="tile")
+        return _pool
+
+
+def _reset_pool():
+    # A forked child (e.g. a ProcessPoolEngine worker) inherits the pool object
+    # but not its threads
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_pool)
+
+
+def default_tiles():
+    """Tile grid used when a detector does not set one: none on a single core"""
+    return (1, 1) if (os.cpu_count() or 1) == 1 else (4, 4)
+
+
+def grid(height, width, rows, cols):
+    """Split an image into rows x cols tiles given as (y0, y1, x0, x1)"""
+    ys = [int(y) for y in np.linspace(0, height, rows + 1)]
+    xs = [int(x) for x in np.linspace(0, width, cols + 1)]
+    return [(ys[r], ys[r + 1], xs[c], xs[c + 1])
+            for r in range(rows) for c in range(cols)
+            if ys[r + 1] > ys[r] and xs[c + 1] > xs[c]]
+
+
+def map_tiles(kernel, tiles):
+    """Run kernel(tile) for every tile, in the shared pool when there are several"""
+    if len(tiles) == 1:
+        return [kernel(tiles[0])]
+    return list(tile_pool().map(kernel, tiles))
+
+
+def _tile_result(mask, tile):
+    """Count and bounding box (in image coordinates) of the non-zero mask pixels of a tile"""
+    y0, y1, x0, x1 = tile
+    count = cv2.countNonZero(mask[y0:y1, x0:x1])
+    bbox = None
+    if count:
+        x, y, w, h = cv2.boundingRect(mask[y0:y1, x0:x1])
+        bbox = (x0 + x, y0 + y, w, h)
+    return {"tile": tile, "count": count, "bbox": bbox}
+
+
+def reduce_tiles(results):
+    """Total count and the bounding boxes of tiles that have any hits"""
+    total = sum(result["count"] for result in results)
+    boxes = [result["bbox"] for result in results if result["bbox"] is not None]
+    return total, boxes
+
+
+def diff_threshold_tiles(prev, current, threshold, tiles):
+    """absdiff of two gray images followed by a binary threshold, per tile.
+
+    The tiles do not have to cover the whole image, pixels outside of them
+    stay zero. Returns the full binary mask and per-tile results from
+    `_tile_result`.
+    """
+    mask = np.zeros(current.shape[:2], dtype=np.uint8)
+
+    def kernel(tile):
+        y0, y1, x0, x1 = tile
+        out = mask[y0:y1, x0:x1]
+        cv2.absdiff(prev[y0:y1, x0:x1], current[y0:y1, x0:x1], dst=out)
+        cv2.threshold(out, threshold, 255, cv2.THRESH_BINARY, dst=out)
+        return _tile_result(mask, tile)
+
+    return mask, map_tiles(kernel, tiles)
+
+
+def flag_cells(coarse_mask, rows, cols, spread=1):
+    """Which cells of a rows x cols grid contain hits of a (downscaled) binary mask.
+
+    Neighbouring cells within `spread` are flagged too, so anything crossing
+    a cell border is still covered. Returns a (rows, cols) bool array.
+    """
+    # INTER_AREA averages every source pixel of a cell into it
+    flags = cv2.resize(coarse_mask, (cols, rows), interpolation=cv2.INTER_AREA) > 0
+    if spread and flags.any():
+        kernel = np.ones((2 * spread + 1, 2 * spread + 1), dtype=np.uint8)
+        flags = cv2.dilate(flags.astype(np.uint8), kernel) > 0
+    return flags
+
+
+def channel_luts(colors):
+    """Per-channel lookup tables for a list of (lower, upper) BGR boxes.
+
+    Bit i of lut[c][v] is set when value v of channel c lies inside box i,
+    so AND-ing the three looked up channels leaves exactly the bits of the
+    boxes a pixel falls into. Up to 8 boxes fit into the uint8 tables.
+    """
+    if len(colors) > 8:
+        raise ValueError(f"At most 8 colors fit into one lookup table, got {len(colors)}")
+    values = np.arange(256)
+    luts = np.zeros((3, 256), dtype=np.uint8)
+    for bit, (lower, upper) in enumerate(colors):
+        for channel in range(3):
+            inside = (values >= lower[channel]) & (values <= upper[channel])
+            luts[channel][inside] |= 1 << bit
+    return luts
+
+
+def color_lut_tiles(frame, luts, colors, tiles, strip=64):
+    """Classify BGR pixels with `channel_luts` tables, per tile.
+
+    Each tile is processed in strips of `strip` rows so the split channels
+    and the mask stay in cache between the lookups. Returns the full uint8
+    bit mask and, per tile, a list with the pixel count of each of the
+    first `colors` bits.
+    """
+    mask = np.empty(frame.shape[:2], dtype=np.uint8)
+
+    def kernel(tile):
+        y0, y1, x0, x1 = tile
+        counts = [0] * colors
+        for y in range(y0, y1, strip):
+            out = mask[y:min(y + strip, y1), x0:x1]
+            channels = cv2.split(frame[y:min(y + strip, y1), x0:x1])
+            cv2.LUT(channels[0], luts[0], dst=out)
+            for channel in (1, 2):
+                cv2.bitwise_and(out, cv2.LUT(channels[channel], luts[channel]), dst=out)
+            for bit in range(colors):
+                counts[bit] += cv2.countNonZero(cv2.bitwise_and(out, 1 << bit))
+        return counts
+
+    return mask, map_tiles(kernel, tiles)
@@ -7,7 +7,7 @@ class AnalyzerGUI:
     def __init__(self, root):
         self.root = root
         self.root.title("Screen Video Stream Analyzer")
-        self.root.geometry("400x300")
+        self.root.geometry("400x400")
         
         self.analyzer = ScreenAnalyzer()
         self.analysis_thread = None
@@ -26,6 +26,22 @@ class AnalyzerGUI:
             ttk.Radiobutton(fps_frame, text=str(fps), value=fps, 
                             variable=self.fps_var, command=self.set_fps).pack(side=tk.LEFT, padx=10)
         
+        # Detectors come from the shared engine registry
+        detectors_frame = ttk.LabelFrame(self.root, text="Detectors")
+        detectors_frame.pack(fill="x", padx=10, pady=10)
+        
+        self.detector_vars = {}
+        for detector in self.analyzer.engine.detectors:
+            var = tk.BooleanVar(value=detector.enabled)
+            ttk.Checkbutton(detectors_frame, text=detector.label, variable=var,
+                            command=self.update_detectors).pack(anchor=tk.W, padx=10)
+            self.detector_vars[detector.name] = var
+        
+        # Per-stage timings drawn on the preview window
+        self.overlay_var = tk.BooleanVar(value=self.analyzer.profile_overlay)
+        ttk.Checkbutton(detectors_frame, text="Profiling overlay", variable=self.overlay_var,
+                        command=self.update_overlay).pack(anchor=tk.W, padx=10)
+        
         # Control buttons
         control_frame = ttk.Frame(self.root)
         control_frame.pack(fill="x", padx=10, pady=10)
@@ -52,6 +68,13 @@ class AnalyzerGUI:
         self.analyzer.set_fps(fps)
         self.status_var.set(f"FPS set to {fps}")
     
+    def update_detectors(self):
+        for name, var in self.detector_vars.items():
+            self.analyzer.engine.configure(name, enabled=var.get())
+    
+    def update_overlay(self):
+        self.analyzer.profile_overlay = self.overlay_var.get()
+    
     def select_roi(self):
         self.status_var.set("Selecting region...")
         self.select_roi_btn.config(state=tk.DISABLED)
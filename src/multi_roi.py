@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor
+from frame_buffer import RegionRingBuffer
+from engine import DetectionEngine
+from detectors import create_detector
+from events import EventAggregator
+
+
+def bounding_box(regions):
+    """Smallest (x1, y1, x2, y2) holding the "roi" of every region"""
+    rois = [region["roi"] for region in regions.values()]
+    return (min(roi[0] for roi in rois), min(roi[1] for roi in rois),
+            max(roi[2] for roi in rois), max(roi[3] for roi in rois))
+
+
+def check_regions(regions, width=None, height=None):
+    """Raise ValueError for a region that is malformed or outside a width x height frame.
+
+    Also checks the region's detectors and thresholds, so bad regions are
+    found before an analysis starts rather than in the middle of it.
+    """
+    if not regions:
+        raise ValueError("No regions given")
+    for name, region in regions.items():
+        roi = region.get("roi") or ()
+        if len(roi) != 4:
+            raise ValueError(f"Region {name} needs a roi of four coordinates")
+        x1, y1, x2, y2 = roi
+        if not (0 <= x1 < x2 and 0 <= y1 < y2):
+            raise ValueError(f"Region {name} ({x1}, {y1}, {x2}, {y2}) is empty or negative")
+        if width is not None and (x2 > width or y2 > height):
+            raise ValueError(f"Region {name} ({x1}, {y1}, {x2}, {y2}) is outside the {width}x{height} frame")
+        detectors = region.get("detectors")
+        for detector, thresholds in region.get("thresholds", {}).items():
+            if detectors is not None and detector not in detectors:
+                raise ValueError(f"Region {name} has thresholds for {detector}, which it does not run")
+            create_detector(detector, **thresholds)
+        for detector in detectors or ():
+            create_detector(detector)
+
+
+class MultiRegionEngine:
+    """Runs one DetectionEngine per named region of a shared capture.
+
+    `regions` maps a name to {"roi": (x1, y1, x2, y2), "detectors": [...],
+    "thresholds": {detector: {name: value}}}; "detectors" (all when
+    missing) and "thresholds" are optional. Only the bounding box of all
+    regions is captured, each region reads its rectangle of it through a
+    RegionRingBuffer, so the grab is paid once per frame and nothing is
+    copied. The regions of a frame are analyzed in parallel on a thread
+    pool (OpenCV releases the GIL), every region with its own detectors,
+    state and aggregated events.
+    """
+
+    def __init__(self, regions, fps=30, offline=False, report_limit=None, latency=None):
+        if not regions:
+            raise ValueError("No regions given")
+        self.box = bounding_box(regions)
+        self.rois = {}
+        self.engines = {}
+        self.rings = {}
+        for name, region in regions.items():
+            engine = DetectionEngine(fps, region.get("detectors"), offline=offline,
+                                     report_limit=report_limit, aggregator=EventAggregator())
+            for detector, thresholds in region.get("thresholds", {}).items():
+                engine.configure(detector, **thresholds)
+            if latency is not None:
+                # One set of stage timings for the session, per region totals on top
+                engine.latency = latency
+            self.rois[name] = tuple(region["roi"])
+            self.engines[name] = engine
+        self.latency = latency
+        self._executor = ThreadPoolExecutor(max_workers=len(regions), thread_name_prefix="region")
+
+    @property
+    def history(self):
+        return max(engine.history for engine in self.engines.values())
+
+    @property
+    def incident_count(self):
+        return sum(engine.incident_count for engine in self.engines.values())
+
+    def attach(self, ring, origin=(0, 0)):
+        """Read the regions from `ring`, whose frames have their top left corner at `origin`"""
+        ox, oy = origin
+        self.rings = {name: RegionRingBuffer(ring, x1 - ox, y1 - oy, x2 - ox, y2 - oy)
+                      for name, (x1, y1, x2, y2) in self.rois.items()}
+
+    def _process(self, name, index):
+        engine = self.engines[name]
+        if self.latency is None:
+            return engine.process(self.rings[name].context(index))
+        with self.latency.stage("region." + name):
+            return engine.process(self.rings[name].context(index))
+
+    def process(self, index):
+        """Analyze frame `index` in every region, return (region name, incident) pairs"""
+        futures = [(name, self._executor.submit(self._process, name, index)) for name in self.engines]
+        return [(name, incident) for name, future in futures for incident in future.result()]
+
+    def set_fps(self, fps):
+        for engine in self.engines.values():
+            engine.fps = fps
+
+    def finish(self):
+        for engine in self.engines.values():
+            engine.finish()
+
+    def close(self):
+        self._executor.shutdown()
@@ -0,0 +1,583 @@
+"""Analyze many independent streams in one process.
+
+Every stream (a video file, a synthetic source or a screen region) gets its
+own detectors, events and report folder, while one pool of worker threads
+runs them all:
+
+    python multi_stream.py cam1.mp4 cam2.mp4 cam3.mp4 --workers 4
+    python multi_stream.py --screen left 0 0 960 1080 --screen right 960 0 1920 1080 --duration 600
+    python multi_stream.py --config wall.json --paced
+
+A config file holds the same options with underscores plus "streams": a
+list of {"source": ..., "name": ..., "roi": [x1, y1, x2, y2], "fps": ...,
+"paced": ..., "detectors": [...], "thresholds": {...}, "weight": ...,
+"frames": ...}, where only "source" is required.
+
+Exit codes as for cli.py: 0 no defects found, 1 defects found, 2 invalid
+arguments or config, 3 no stream could be opened or admitted, 4 a stream
+failed, 130 interrupted.
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from frame_source import open_frame_source
+from frame_buffer import FrameRingBuffer
+from engine import DetectionEngine
+from detectors import DETECTORS
+from events import EventAggregator
+from report_writer import IncidentWriter, ImageEncoder, IMAGE_FORMATS
+from report_store import FrameMetrics, clock_anchor, write_manifest
+from scheduler import DeadlineScheduler
+from histogram import summary_lines
+from profiler import write_profile
+
+# Stream states that still take pool time
+RUNNING = ("admitted", "degraded")
+
+
+class AdmissionError(RuntimeError):
+    """The session has no capacity left for a new stream"""
+
+
+class AnalysisStream:
+    """One source of a StreamSession with its own ring buffer, detectors and report.
+
+    `step()` captures and analyzes a single frame. The session never runs
+    two steps of a stream at once, so the detectors and the event
+    aggregator still see every frame in order. Paced streams take their
+    frames on the deadlines of a DeadlineScheduler (live sources always
+    are, files can be replayed at their real rate); the others read as fast
+    as they get pool time.
+    """
+
+    def __init__(self, name, source, report_dir, fps=None, detectors=None, thresholds=None, paced=None,
+                 policy="skip", weight=1.0, max_frames=None, image_format="png", image_quality=None,
+                 report_limit=100):
+        self.name = name
+        self.source = source
+        self.report_dir = report_dir
+        self.paced = source.realtime if paced is None else paced
+        self.fps = fps or source.fps or 30
+        self.requested_fps = self.fps
+        self.weight = weight
+        self.max_frames = max_frames
+        self.image_format = image_format
+        self.image_quality = image_quality
+        self.engine = DetectionEngine(self.fps, detectors, offline=not source.realtime,
+                                      report_limit=report_limit, aggregator=EventAggregator())
+        for detector, values in (thresholds or {}).items():
+            self.engine.configure(detector, **values)
+        # The history and the frame being analyzed, a stream runs one step at a time
+        self.ring = FrameRingBuffer(self.engine.history + 2, source.height, source.width)
+        self.ring.latency = self.engine.latency
+        source.latency = self.engine.latency
+        self.scheduler = DeadlineScheduler(self.fps, policy)
+
+        self.status = "new"  # then admitted, degraded, refused, finished, failed or stopped
+        self.error = None
+        self.frames = 0
+        self.busy = 0.0  # Seconds spent analyzing this stream, probe frames included
+        self.probe_busy = 0.0  # Of that, probe frames analyzed on the caller's thread
+        self.vtime = 0.0  # Fair share clock: busy time divided by weight
+        self.active = False  # A step is running
+        self.started = None
+        self.ended = None
+        self._gap = False
+        self._prev_time = None
+        self.clock = None  # Wall clock anchor of live frame times, see clock_anchor
+
+    def open(self):
+        """Start the report writer, before the first step"""
+        # Incident images are rare next to frames, one encoding thread per stream is plenty
+        encoder = ImageEncoder(self.image_format, self.image_quality, workers=1, latency=self.engine.latency)
+        self.engine.writer = IncidentWriter(self.report_dir, encoder=encoder,
+                                            policy="drop_frame" if self.paced else "block").start()
+        self.engine.metrics = FrameMetrics(self.report_dir, [d.name for d in self.engine.detectors])
+        self.started = time.perf_counter()
+        # Written again by close(), until then it keeps the clock of a crashed run
+        self.clock = clock_anchor() if self.source.realtime else None
+        write_manifest(self.report_dir, complete=False, name=self.name, clock=self.clock)
+
+    @property
+    def cost(self):
+        """Mean pool seconds per frame, None before the first frame"""
+        return self.busy / self.frames if self.frames else None
+
+    def set_fps(self, fps):
+        self.fps = fps
+        self.engine.fps = fps
+        self.scheduler.set_fps(fps)
+
+    def take(self):
+        """Claim the due frame of a paced stream, recording how late it is taken"""
+        skipped = self.scheduler.skipped
+        deadline = self.scheduler.poll()
+        if deadline is None:
+            return False
+        self.engine.latency.record("lag", max(DeadlineScheduler.now() - deadline, 0.0))
+        # Frames skipped for lack of pool time are not the source's fault
+        if self.scheduler.skipped != skipped:
+            self._gap = True
+        return True
+
+    def step(self):
+        """Capture and analyze the next frame; its incidents, or None at the end of the source"""
+        if self.max_frames is not None and self.frames >= self.max_frames:
+            return None
+        start = time.perf_counter()
+        with self.engine.latency.stage("capture"):
+            frame, timestamp = self.source.read(out=self.ring.next_slot())
+        if frame is None:
+            return [] if self.source.realtime else None
+
+        index = self.ring.commit(timestamp, gap=self._gap)
+        self._gap = False
+        if self._prev_time is not None:
+            self.engine.latency.record("interval", timestamp - self._prev_time)
+        self._prev_time = timestamp
+        incidents = self.engine.process(self.ring.context(index))
+
+        elapsed = time.perf_counter() - start
+        self.frames += 1
+        self.busy += elapsed
+        self.vtime += elapsed / self.weight
+        return incidents
+
+    def stats(self):
+        elapsed = (self.ended or time.perf_counter()) - self.started if self.started else 0.0
+        lag = self.engine.latency.histograms.get("lag")
+        return {
+            "name": self.name,
+            "status": self.status,
+            "paced": self.paced,
+            "fps": self.fps,
+            "requested_fps": self.requested_fps,
+            "frames": self.frames,
+            "analyzed_fps": self.frames / elapsed if elapsed > 0 else 0.0,
+            "cost_ms": self.cost * 1000 if self.cost is not None else None,
+            "busy": self.busy - self.probe_busy,
+            "probe": self.probe_busy,
+            "incidents": self.engine.incident_count,
+            "events": self.engine.event_count,
+            "missed": self.scheduler.missed,
+            "skipped": self.scheduler.skipped,
+            "lag_p95_ms": lag.percentile(95) * 1000 if lag is not None else None,
+            "error": self.error
+        }
+
+    def close(self, status=None):
+        """Stop the source, close the open events and write the stream's report"""
+        if self.ended is not None:
+            return
+        if status is not None:
+            self.status = status
+        self.ended = time.perf_counter()
+        self.source.close()
+        if self.engine.writer is not None:
+            self.engine.finish()
+            self.engine.writer.close()
+            self.engine.metrics.close()
+        summary = self.engine.latency.summary()
+        write_profile(self.report_dir, summary, self.ended - (self.started or self.ended))
+        write_manifest(self.report_dir, frames=self.frames, events=self.engine.event_count,
+                       clock=self.clock, latency=summary, **{key: value for key, value in self.stats().items()
+                                           if key not in ("frames", "events")})
+
+
+class StreamSession:
+    """Runs many AnalysisStreams on one shared pool of worker threads.
+
+    Every stream reports to its own folder of one report_<timestamp>
+    directory. The `workers` threads (one per core by default) run frame
+    steps of all streams; OpenCV releases the GIL, so they spread over the
+    cores. A free worker goes to a paced stream whose frame is due, and
+    only when none is to an unpaced one; within each group the stream with
+    the least pool time used (divided by its weight) goes first, so no
+    stream starves the others. New streams start at the current minimum of
+    that clock instead of at zero.
+
+    Admission control keeps paced streams from silently lagging: they may
+    commit at most `max_load` of the workers, a stream needing fps x cost
+    per frame. The cost of a new paced stream is measured on its first
+    `probe_frames` frames (analyzed for real, on the caller's thread, so a
+    busy box shows up as a higher cost). A stream that does not fit at its
+    rate is degraded to the rate that does, down to `min_fps`; below that
+    it is refused with AdmissionError. Unpaced streams only use the time
+    paced ones leave, so they are admitted up to `max_streams`.
+    """
+
+    def __init__(self, output_dir="reports", workers=None, max_load=0.8, min_fps=5, max_streams=None,
+                 probe_frames=10):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_load = max_load
+        self.min_fps = min_fps
+        self.max_streams = max_streams
+        self.probe_frames = probe_frames
+        self.verbose = True  # Print every incident as it is detected
+        self.image_format = "png"
+        self.image_quality = None
+        self.report_limit = 100
+        self.streams = {}
+        self.report_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.report_dir = os.path.join(output_dir, f"report_{self.report_timestamp}")
+        self.running = False
+        self.started = None
+        self._busy = 0
+        self._cond = threading.Condition()
+        self._admit_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="stream")
+        self._dispatcher = None
+
+    @property
+    def capacity(self):
+        """Workers paced streams may take together"""
+        return self.workers * self.max_load
+
+    def active_streams(self):
+        return [stream for stream in list(self.streams.values()) if stream.status in RUNNING]
+
+    def paced_load(self):
+        """Workers the admitted paced streams need at their current rates"""
+        return sum(stream.fps * stream.cost for stream in self.active_streams()
+                   if stream.paced and stream.cost is not None)
+
+    def add_stream(self, name, source, **options):
+        """Admit a stream and start analyzing it, returns its AnalysisStream.
+
+        `options` go to AnalysisStream. Raises AdmissionError, after closing
+        `source`, when the session has no room for it.
+        """
+        with self._admit_lock:
+            if not name or os.sep in name or name in self.streams:
+                source.close()
+                raise ValueError(f"Invalid or duplicate stream name '{name}'")
+            if self.max_streams is not None and len(self.active_streams()) >= self.max_streams:
+                source.close()
+                raise AdmissionError(f"{name}: the session is full ({self.max_streams} streams)")
+            stream = AnalysisStream(name, source, os.path.join(self.report_dir, name),
+                                    image_format=self.image_format, image_quality=self.image_quality,
+                                    report_limit=self.report_limit, **options)
+            stream.open()
+            if stream.paced:
+                self._admit(stream)
+            if stream.status == "new":
+                stream.status = "admitted"
+            with self._cond:
+                # Start even with the others, not ahead of them by everything they used
+                stream.vtime = min((other.vtime for other in self.active_streams()), default=0.0)
+                self.streams[name] = stream
+                self._cond.notify_all()
+        if stream.status == "refused":
+            raise AdmissionError(f"{name}: {stream.error}")
+        if stream.status == "degraded":
+            print(f"[{name}] Degraded to {stream.fps:.1f} FPS of {stream.requested_fps:.1f}, "
+                  f"the pool is near its limit")
+        return stream
+
+    def _admit(self, stream):
+        """Probe the cost of a paced stream and fit its rate into the free capacity"""
+        for _ in range(self.probe_frames):
+            busy = stream.busy
+            incidents = stream.step()
+            # Not pool time, kept out of the pool utilization
+            stream.probe_busy += stream.busy - busy
+            if incidents is None:
+                stream.close("finished")
+                return
+            self._report(stream, incidents)
+        if not stream.cost:
+            return
+
+        free = self.capacity - self.paced_load()
+        fps = min(stream.requested_fps, free / stream.cost)
+        if fps >= stream.requested_fps:
+            return
+        if fps < min(self.min_fps, stream.requested_fps):
+            stream.error = (f"needs {stream.cost * stream.requested_fps:.2f} workers at "
+                            f"{stream.requested_fps:.1f} FPS, {max(free, 0.0):.2f} of {self.workers} free")
+            stream.close("refused")
+            return
+        stream.set_fps(int(fps * 10) / 10.0)
+        stream.status = "degraded"
+
+    def _report(self, stream, incidents):
+        if self.verbose:
+            for incident in incidents:
+                print(f"[{stream.name}] {incident['label']} detected: {incident['details']}")
+
+    def start(self):
+        self.running = True
+        self.started = time.perf_counter()
+        self._dispatcher = threading.Thread(target=self._run, name="StreamSession", daemon=True)
+        self._dispatcher.start()
+        return self
+
+    def _select(self, now):
+        """The stream to run next or, when none is ready, seconds until a paced one is due"""
+        due, ready, wait = [], [], None
+        for stream in self.active_streams():
+            if stream.active:
+                continue
+            if not stream.paced:
+                ready.append(stream)
+                continue
+            delay = stream.scheduler.next_deadline() - now
+            if delay <= 0:
+                due.append(stream)
+            elif wait is None or delay < wait:
+                wait = delay
+        candidates = due or ready
+        if candidates:
+            return min(candidates, key=lambda stream: stream.vtime), None
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self.running:
+                        return
+                    stream, wait = None, None
+                    if self._busy < self.workers:
+                        stream, wait = self._select(DeadlineScheduler.now())
+                    if stream is not None:
+                        if not stream.paced or stream.take():
+                            break
+                        # Due by a rounding error of the clock only
+                        wait = 0.0005
+                    self._cond.wait(wait)
+                stream.active = True
+                self._busy += 1
+            self._executor.submit(self._step, stream)
+
+    def _step(self, stream):
+        try:
+            incidents = stream.step()
+        except Exception as e:
+            stream.error = str(e)
+            print(f"[{stream.name}] Analysis failed: {e}")
+            incidents = None
+        if incidents is None:
+            stream.close("failed" if stream.error else "finished")
+        else:
+            self._report(stream, incidents)
+        with self._cond:
+            stream.active = False
+            self._busy -= 1
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        """Wait until every stream has ended, True if they all did"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._busy and not self.active_streams(), timeout)
+
+    def throughput(self):
+        """Session totals and the stats of every stream"""
+        elapsed = time.perf_counter() - self.started if self.started else 0.0
+        streams = [stream.stats() for stream in list(self.streams.values())]
+        frames = sum(stream["frames"] for stream in streams)
+        busy = sum(stream["busy"] for stream in streams)
+        statuses = {}
+        for stream in streams:
+            statuses[stream["status"]] = statuses.get(stream["status"], 0) + 1
+        return {
+            "elapsed": elapsed,
+            "workers": self.workers,
+            "statuses": statuses,
+            "frames": frames,
+            "fps": frames / elapsed if elapsed > 0 else 0.0,
+            "utilization": busy / (elapsed * self.workers) if elapsed > 0 else 0.0,
+            "paced_load": self.paced_load(),
+            "capacity": self.capacity,
+            "skipped": sum(stream["skipped"] for stream in streams),
+            "streams": streams
+        }
+
+    def status_line(self, view=None):
+        view = view or self.throughput()
+        states = ", ".join(f"{count} {status}" for status, count in sorted(view["statuses"].items()))
+        return (f"{len(view['streams'])} streams ({states or 'none running'}): {view['fps']:.1f} FPS, "
+                f"pool {view['utilization'] * 100:.0f}% busy, paced load {view['paced_load']:.2f} "
+                f"of {view['capacity']:.2f} workers, {view['skipped']} frames skipped")
+
+    def stop(self):
+        """Stop every stream and write the session report"""
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: not self._busy)
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        self._executor.shutdown()
+        # The load of the streams that were still running, closing them ends it
+        paced_load = self.paced_load()
+        for stream in self.streams.values():
+            stream.close("stopped")
+
+        view = dict(self.throughput(), paced_load=paced_load)
+        print(self.status_line(view))
+        self.save_report(view)
+        write_manifest(self.report_dir, started=self.report_timestamp, streams=list(self.streams),
+                       **{key: value for key, value in view.items() if key != "streams"})
+        return view
+
+    def save_report(self, view):
+        """Write summary.txt with one line per stream"""
+        os.makedirs(self.report_dir, exist_ok=True)
+        with open(os.path.join(self.report_dir, "summary.txt"), "w") as f:
+            f.write(f"Multi-stream Analysis Report - {self.report_timestamp}\n")
+            f.write(f"{self.status_line(view)}\n")
+            f.write(f"Session: {view['elapsed']:.2f}s on {self.workers} workers\n\n")
+            f.write(f"{'stream':<20}{'status':<10}{'FPS':>8}{'of':>8}{'frames':>9}{'ms/frame':>10}"
+                    f"{'lag p95':>9}{'skipped':>9}{'events':>8}\n")
+            for stream in view["streams"]:
+                cost = f"{stream['cost_ms']:.2f}" if stream["cost_ms"] is not None else "-"
+                lag = f"{stream['lag_p95_ms']:.1f}" if stream["lag_p95_ms"] is not None else "-"
+                f.write(f"{stream['name'][:19]:<20}{stream['status']:<10}{stream['analyzed_fps']:>8.1f}"
+                        f"{stream['fps']:>8.1f}{stream['frames']:>9}{cost:>10}{lag:>9}"
+                        f"{stream['skipped']:>9}{stream['events']:>8}\n")
+                if stream["error"]:
+                    f.write(f"  {stream['error']}\n")
+            for name, stream in self.streams.items():
+                f.write(f"\n[{name}] {stream.source.__class__.__name__}\n")
+                for line in summary_lines(stream.engine.latency.summary()):
+                    f.write(f"{line}\n")
+        print(f"Report saved to {self.report_dir}")
+
+
+def stream_specs(args, parser):
+    """Stream descriptions from the sources, --screen options and the config, with unique names"""
+    specs = [{"source": source} for source in args.sources]
+    for name, *roi in args.screens or []:
+        try:
+            specs.append({"source": "screen", "name": name, "roi": [int(value) for value in roi]})
+        except ValueError:
+            parser.error(f"--screen {name} expects four integer coordinates")
+    specs += args.streams
+    names = set()
+    for spec in specs:
+        if "source" not in spec:
+            parser.error(f"stream without a source: {spec}")
+        if spec["source"] == "screen" and len(spec.get("roi") or ()) != 4:
+            parser.error("screen streams need a roi of four coordinates")
+        if spec["source"].startswith("synthetic") and args.duration is None \
+                and spec.get("frames", args.frames) is None:
+            parser.error("synthetic sources never end, give --duration or --frames")
+        # Names become folder names, "synthetic:noise" becomes "synthetic_noise"
+        name = spec.get("name") or re.sub(r"[^\w.-]", "_", os.path.splitext(os.path.basename(spec["source"]))[0])
+        name = name or "stream"
+        base, number = name, 2
+        while name in names:
+            name = f"{base}_{number}"
+            number += 1
+        names.add(name)
+        spec["name"] = name
+    return specs
+
+
+def main(argv=None):
+    # Shared with the single-stream tool, which also owns their meaning
+    from cli import EXIT_CLEAN, EXIT_DEFECTS, EXIT_SOURCE, EXIT_FAILED, EXIT_INTERRUPTED
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sources", nargs="*", help='video files or "synthetic[:pattern]"')
+    parser.add_argument("--config", help="JSON file with default values and a \"streams\" list")
+    parser.add_argument("--screen", nargs=5, action="append", metavar=("NAME", "X1", "Y1", "X2", "Y2"),
+                        dest="screens", help="screen region analyzed as a live stream, can be repeated")
+    parser.add_argument("--fps", type=float, help="analysis rate, for video files the container rate is used")
+    parser.add_argument("--paced", action="store_true", default=None,
+                        help="replay files and synthetic sources at their real rate, like live streams")
+    parser.add_argument("--duration", type=float, help="stop the session after this many seconds")
+    parser.add_argument("--frames", type=int, help="stop each stream after this many frames")
+    parser.add_argument("--detectors", nargs="+", choices=list(DETECTORS), help="run only these detectors")
+    parser.add_argument("--workers", type=int, help="pool threads shared by all streams (default: cores)")
+    parser.add_argument("--max-load", type=float, default=0.8,
+                        help="share of the workers paced streams may take together")
+    parser.add_argument("--min-fps", type=float, default=5,
+                        help="paced streams that do not fit at this rate are refused")
+    parser.add_argument("--max-streams", type=int, help="refuse streams beyond this many")
+    parser.add_argument("--output-dir", default="reports")
+    parser.add_argument("--image-format", choices=list(IMAGE_FORMATS), default="png")
+    parser.add_argument("--quiet", action="store_true", default=None,
+                        help="only print the session status, not every incident")
+
+    args, _ = parser.parse_known_args(argv)
+    streams = []
+    if args.config:
+        try:
+            with open(args.config) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read config {args.config}: {e}")
+        streams = config.pop("streams", [])
+        unknown = set(config) - {action.dest for action in parser._actions}
+        if unknown:
+            parser.error(f"unknown config keys: {', '.join(sorted(unknown))}")
+        parser.set_defaults(**config)
+    args = parser.parse_args(argv)
+    args.streams = streams
+    specs = stream_specs(args, parser)
+    if not specs:
+        parser.error("no streams given")
+
+    session = StreamSession(args.output_dir, args.workers, args.max_load, args.min_fps, args.max_streams)
+    session.verbose = not args.quiet
+    session.image_format = args.image_format
+    session.start()
+    status = EXIT_CLEAN
+    try:
+        for spec in specs:
+            fps = spec.get("fps", args.fps)
+            try:
+                source = open_frame_source(spec["source"], spec.get("roi"), fps or 30)
+            except Exception as e:
+                print(f"Cannot open source {spec['source']}: {e}", file=sys.stderr)
+                continue
+            paced = spec.get("paced", args.paced)
+            try:
+                stream = session.add_stream(spec["name"], source, fps=fps, paced=paced or None,
+                                            detectors=spec.get("detectors", args.detectors),
+                                            thresholds=spec.get("thresholds"), weight=spec.get("weight", 1.0),
+                                            max_frames=spec.get("frames", args.frames))
+            except AdmissionError as e:
+                print(f"Refused {e}", file=sys.stderr)
+                continue
+            except (KeyError, ValueError) as e:
+                parser.error(f"stream {spec['name']}: {e}")
+            print(f"[{stream.name}] {stream.source.width}x{stream.source.height} at {stream.fps:.1f} FPS, "
+                  f"{'paced' if stream.paced else 'as fast as possible'}")
+        # Streams may already have finished while their cost was probed,
+        # only a session that admitted none has nothing to analyze
+        if all(stream.status == "refused" for stream in session.streams.values()):
+            status = EXIT_SOURCE
+
+        last_status = time.perf_counter()
+        while status == EXIT_CLEAN and not session.join(timeout=1.0):
+            now = time.perf_counter()
+            if args.duration is not None and now - session.started >= args.duration:
+                break
+            if now - last_status >= 5.0:
+                last_status = now
+                print(session.status_line())
+    except KeyboardInterrupt:
+        status = EXIT_INTERRUPTED
+    finally:
+        view = session.stop()
+
+    if status != EXIT_CLEAN:
+        return status
+    if any(stream["status"] == "failed" for stream in view["streams"]):
+        return EXIT_FAILED
+    if not view["frames"]:
+        return EXIT_SOURCE
+    return EXIT_DEFECTS if any(stream["incidents"] for stream in view["streams"]) else EXIT_CLEAN
+
+
+if __name__ == "__main__":
+    sys.exit(main())
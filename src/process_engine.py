@@ -0,0 +1,165 @@
+import collections
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from frame_buffer import FrameRingBuffer
+from detectors import create_detector
+
+# State of a pool worker process, set up once by _init_worker
+_worker = {}
+
+
+class _Timings(list):
+    """Collects (stage, seconds) pairs in a worker, in place of a LatencyStats"""
+
+    def record(self, name, seconds):
+        self.append((name, seconds))
+
+
+def _init_worker(shm_name, capacity, height, width):
+    # Workers share the parent's resource tracker, the parent unlinks the block
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker["shm"] = shm
+    _worker["ring"] = FrameRingBuffer(capacity, height, width, buffer=shm.buf)
+    _worker["detectors"] = {}
+
+
+def _detect_frame(index, frames, fps, configs):
+    """Run detectors on one shared-memory frame.
+
+    `frames` holds (index, time, gap) of the frame and the history before it.
+    Returns incident records without frames and (stage, seconds) timings of
+    the detectors and the conversions they triggered.
+    """
+    ring = _worker["ring"]
+    for frame_index, frame_time, gap in frames:
+        ring.times[frame_index % ring.capacity] = frame_time
+        ring.gaps[frame_index % ring.capacity] = gap
+    # The oldest history frame starts a run as far as this worker knows
+    oldest = frames[-1][0]
+    if oldest > 0:
+        ring.gaps[oldest % ring.capacity] = True
+    ring.count = max(ring.count, index + 1)
+    context = ring.context(index)
+
+    records = []
+    timings = ring.latency = _Timings()
+    for name, thresholds in configs:
+        detector = _worker["detectors"].get(name)
+        if detector is None:
+            detector = _worker["detectors"][name] = create_detector(name)
+        detector.configure(**thresholds)
+
+        start = time.perf_counter()
+        incident = detector.detect(context, fps)
+        timings.record("detect." + name, time.perf_counter() - start)
+        if incident is not None:
+            # Annotated frames stay in the worker, only numbers travel back
+            incident.pop("frame", None)
+            incident["type"] = name
+            records.append(incident)
+    return records, timings
+
+
+class ProcessPoolEngine:
+    """Run the detectors of a DetectionEngine in worker processes.
+
+    Frames are captured into a ring buffer placed in shared memory, which
+    the workers attach to once and read without copying. Only frame indices
+    and timestamps are sent to the workers and only small incident records
+    come back; the parent attaches a copy of the (unannotated) frame to each
+    incident. Results are merged into the engine report in frame order;
+    stateful detectors, which need every frame in order, run in the parent
+    at that point. The "frame" latency of the engine is measured from
+    submission to merge, so it includes the time a frame waits for a worker.
+    """
+
+    def __init__(self, engine, height, width, workers=None, capacity=None):
+        self.engine = engine
+        self.workers = workers or os.cpu_count() or 1
+        capacity = capacity or self.workers * 2 + 2
+
+        self.shm = shared_memory.SharedMemory(create=True, size=capacity * height * width * 3)
+        self.ring = FrameRingBuffer(capacity, height, width, buffer=self.shm.buf)
+        self.ring.latency = engine.latency
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                            initargs=(self.shm.name, capacity, height, width))
+        self.pending = collections.deque()
+        self._merged = []
+
+    def capture(self, source, gap=False):
+        """Read the next frame into shared memory, waiting for a free slot.
+
+        Returns the frame index, or None when the source is exhausted.
+        """
+        while not self.ring.writable():
+            self.collect(block=True)
+        return self.ring.capture(source, gap=gap)
+
+    def submit(self, index):
+        """Send frame `index` to the pool; it stays pinned until its result is merged"""
+        pins = self.ring.history(index, self.engine.history)
+        frames = [(i, self.ring.time(i), bool(self.ring.gaps[i % self.ring.capacity])) for i in pins]
+        configs = [(detector.name, detector.thresholds)
+                   for detector in self.engine.detectors if detector.enabled and not detector.stateful]
+
+        self.ring.pin(*pins)
+        future = self.executor.submit(_detect_frame, index, frames, self.engine.fps, configs)
+        self.pending.append((index, pins, future, time.perf_counter()))
+
+    def collect(self, block=False):
+        """Merge finished results in frame order; with block=True wait for the oldest one"""
+        while self.pending:
+            index, pins, future, submitted = self.pending[0]
+            if not block and not future.done():
+                break
+            records, timings = future.result()
+            self.pending.popleft()
+            for name, seconds in timings:
+                self.engine.latency.record(name, seconds)
+
+            frame_time = self.ring.time(index)
+            incidents = []
+            for record in records:
+                # Detectors reporting on an earlier frame set its index, the
+                # history pins keep that frame in the ring
+                record["frame"] = self.ring.frame(record.get("index", index)).copy()
+                incidents.append(self.engine.stamp(record, self.engine.detector(record["type"]),
+                                                   frame_time, index))
+            # Stateful detectors need every frame in order, they run here
+            # while the frame and its history are still pinned
+            stateful = [detector for detector in self.engine.detectors if detector.stateful]
+            if stateful:
+                incidents.extend(self.engine.detect(self.ring.context(index), stateful))
+            self.ring.release(*pins)
+            self.engine.latency.record("frame", time.perf_counter() - submitted)
+            self.engine.record(incidents, index, frame_time)
+            self._merged.extend(incidents)
+            if block:
+                break
+
+    def process(self, index):
+        """Submit a frame and return incidents of frames that finished meanwhile"""
+        self.submit(index)
+        self.collect()
+        incidents, self._merged = self._merged, []
+        return incidents
+
+    def flush(self):
+        """Wait for every submitted frame and return the remaining incidents"""
+        while self.pending:
+            self.collect(block=True)
+        incidents, self._merged = self._merged, []
+        return incidents
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.ring = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Frame views are still referenced somewhere, the mapping goes
+            # away together with them
+            pass
+        self.shm.unlink()
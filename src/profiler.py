@@ -0,0 +1,57 @@
+import os
+import cv2
+
+PROFILE_FILE = "profile.txt"
+
+# Histograms of a LatencyStats that are not stages of the frame loop
+NOT_STAGES = ("interval", "frame", "lag")
+
+
+def breakdown(summary, elapsed=None):
+    """Stages of a LatencyStats summary sorted by total time, as dicts.
+
+    `share` is the part of the session wall time `elapsed` spent in a stage.
+    Stages nest: a detector's time includes the conversions it triggers
+    first, and capture includes the grab and its color conversion.
+    """
+    rows = []
+    for name, stats in summary.items():
+        if name in NOT_STAGES:
+            continue
+        rows.append(dict(stats, stage=name,
+                         share=stats["total"] / elapsed if elapsed else None))
+    rows.sort(key=lambda row: row["total"], reverse=True)
+    return rows
+
+
+def write_profile(report_dir, summary, elapsed):
+    """Write the per-stage timing breakdown of a session to profile.txt"""
+    os.makedirs(report_dir, exist_ok=True)
+    path = os.path.join(report_dir, PROFILE_FILE)
+    with open(path, "w") as f:
+        f.write(f"Session: {elapsed:.2f}s\n")
+        f.write("Share is of the session time, parallel stages can exceed 100%\n")
+        f.write(f"{'stage':<28}{'calls':>8}{'total s':>10}{'share':>8}"
+                f"{'mean ms':>10}{'p95 ms':>10}{'max ms':>10}\n")
+        for row in breakdown(summary, elapsed):
+            share = f"{row['share'] * 100:.1f}%" if row["share"] is not None else "-"
+            f.write(f"{row['stage']:<28}{row['count']:>8}{row['total']:>10.3f}{share:>8}"
+                    f"{row['mean'] * 1000:>10.2f}{row['p95'] * 1000:>10.2f}{row['max'] * 1000:>10.2f}\n")
+    return path
+
+
+def draw_overlay(frame, summary, top=8):
+    """Draw the costliest stages (mean and p95 in ms) in the top left corner of `frame`"""
+    rows = breakdown(summary)[:top]
+    if not rows:
+        return frame
+    line_height = 18
+    height = min(line_height * len(rows) + 8, frame.shape[0])
+    width = min(300, frame.shape[1])
+    # Darken the box instead of blending, it is a single cheap operation
+    frame[:height, :width] //= 3
+    for i, row in enumerate(rows):
+        text = f"{row['stage'][:18]:<18} {row['mean'] * 1000:6.2f} {row['p95'] * 1000:6.2f}"
+        cv2.putText(frame, text, (6, 16 + i * line_height), cv2.FONT_HERSHEY_PLAIN,
+                    1.0, (0, 255, 255), 1, cv2.LINE_AA)
+    return frame
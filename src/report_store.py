@@ -0,0 +1,191 @@
+import glob
+import json
+import os
+import time
+import numpy as np
+from report_writer import INDEX_FILE, read_index
+
+MANIFEST_FILE = "report.json"
+METRICS_PATTERN = "metrics_*.npz"
+
+
+class FrameMetrics:
+    """Per-frame detector metrics stored as columns.
+
+    Every analyzed frame adds one row: frame index, frame time and the
+    metric of each detector (NaN when it did not fire). Rows fill
+    preallocated arrays and are saved as metrics_<n>.npz every `chunk`
+    frames, so memory stays flat and a crash loses at most one chunk.
+    Incidents about an earlier frame (their "index") go to that frame's
+    row, so a full chunk is only saved when the next row arrives.
+    """
+
+    def __init__(self, report_dir, columns, chunk=9000):
+        self.report_dir = report_dir
+        self.columns = list(columns)
+        self.chunk = chunk
+        self.chunks = 0
+        self.frames = 0
+        self._index = np.empty(chunk, dtype=np.int64)
+        self._time = np.empty(chunk, dtype=np.float64)
+        self._values = np.empty((len(self.columns), chunk), dtype=np.float64)
+        self._rows = 0
+
+    def add(self, index, frame_time, incidents):
+        for incident in incidents:
+            age = index - incident.get("index", index)
+            row = self._rows - age
+            if age > 0 and row >= 0 and self._index[row] == incident["index"]:
+                self._set(row, incident)
+        if self._rows == self.chunk:
+            self.flush()
+
+        row = self._rows
+        self._index[row] = index
+        self._time[row] = frame_time
+        self._values[:, row] = np.nan
+        for incident in incidents:
+            if incident.get("index", index) >= index:
+                self._set(row, incident)
+        self._rows += 1
+        self.frames += 1
+
+    def _set(self, row, incident):
+        if incident["type"] in self.columns:
+            self._values[self.columns.index(incident["type"]), row] = incident["metric"]
+
+    def flush(self):
+        """Save the rows collected so far as the next chunk"""
+        if not self._rows:
+            return
+        rows = self._rows
+        os.makedirs(self.report_dir, exist_ok=True)
+        arrays = {name: self._values[column, :rows] for column, name in enumerate(self.columns)}
+        np.savez(os.path.join(self.report_dir, f"metrics_{self.chunks:05d}.npz"),
+                 index=self._index[:rows], time=self._time[:rows], **arrays)
+        self.chunks += 1
+        self._rows = 0
+
+    def close(self):
+        self.flush()
+
+
+def load_metrics(report_dir):
+    """All metric chunks of a report joined into one dict of column arrays"""
+    chunks = [np.load(path) for path in sorted(glob.glob(os.path.join(report_dir, METRICS_PATTERN)))]
+    if not chunks:
+        return {}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0].files}
+
+
+def clock_anchor():
+    """Wall clock and perf_counter read together, for the "clock" of a manifest.
+
+    Live frame times come from time.perf_counter(), whose zero point is
+    arbitrary; with this anchor they map to epoch seconds.
+    """
+    return {"epoch": time.time(), "perf_counter": time.perf_counter()}
+
+
+def write_manifest(report_dir, complete=True, **info):
+    """Write report.json: per-type event counts and time ranges for fast queries.
+
+    Extra keyword arguments (source, fps, ...) are stored as they are; live
+    sessions pass a `clock` from clock_anchor(). Sessions write a manifest
+    with complete=False when they start, so even a crashed run keeps its
+    clock, and the final one when they end.
+    """
+    types = {}
+    for record in read_index(report_dir):
+        start = record["time"]
+        end = record.get("end_time", start)
+        entry = types.setdefault(record["type"], {"count": 0, "start": start, "end": end})
+        entry["count"] += 1
+        entry["start"] = min(entry["start"], start)
+        entry["end"] = max(entry["end"], end)
+
+    manifest = dict(info, complete=complete, types=types,
+                    metrics=sorted(os.path.basename(path) for path in
+                                   glob.glob(os.path.join(report_dir, METRICS_PATTERN))))
+    path = os.path.join(report_dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def _report_dirs(paths):
+    for path in paths:
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            # Multi-region and multi-stream sessions keep one report per region or stream
+            parts = manifest.get("regions") or manifest.get("streams")
+            if parts:
+                yield from (os.path.join(path, part) for part in parts)
+            else:
+                yield path
+        elif os.path.exists(os.path.join(path, INDEX_FILE)):
+            yield path
+        else:
+            # Sessions that never wrote their own manifest (crashed) are
+            # searched through their region and stream folders
+            yield from _report_dirs(sorted(
+                folder for folder in glob.glob(os.path.join(path, "*")) if os.path.isdir(folder) and (
+                    os.path.basename(folder).startswith("report_") or
+                    os.path.exists(os.path.join(folder, MANIFEST_FILE)) or
+                    os.path.exists(os.path.join(folder, INDEX_FILE)))))
+
+
+def query_events(paths, event_type=None, start=None, end=None, wall_clock=False):
+    """Events of the given type overlapping [start, end] across many reports.
+
+    `paths` are report directories or directories containing report_*
+    folders; multi-region and multi-stream sessions are searched one region
+    or stream at a time. The complete manifest of a report is checked
+    first, so reports without a matching type or time range are skipped
+    without reading their index. Reports of a crashed run (no manifest, or
+    only the one written at the start) are read in full instead.
+
+    By default times are in each report's own timeline: stream position for
+    video files, perf_counter seconds for live capture. With `wall_clock`
+    `start` and `end` are epoch seconds and only reports with a clock
+    anchor (live sessions) are searched; their records get "wall_time" and
+    "wall_end_time". Every returned record carries its "report" directory.
+    """
+    def overlaps(first, last):
+        return (start is None or last >= start) and (end is None or first <= end)
+
+    events = []
+    for report_dir in _report_dirs(paths):
+        manifest = {}
+        manifest_path = os.path.join(report_dir, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        offset = 0.0
+        if wall_clock:
+            clock = manifest.get("clock")
+            if not clock:
+                continue
+            offset = clock["epoch"] - clock["perf_counter"]
+        if manifest.get("complete", True) and "types" in manifest:
+            types = manifest["types"]
+            if event_type is None:
+                ranges = list(types.values())
+            else:
+                ranges = [types[event_type]] if event_type in types else []
+            if not any(overlaps(entry["start"] + offset, entry["end"] + offset) for entry in ranges):
+                continue
+
+        for record in read_index(report_dir):
+            if event_type is not None and record["type"] != event_type:
+                continue
+            first, last = record["time"] + offset, record.get("end_time", record["time"]) + offset
+            if overlaps(first, last):
+                if wall_clock:
+                    record["wall_time"], record["wall_end_time"] = first, last
+                record["report"] = report_dir
+                events.append(record)
+    return events
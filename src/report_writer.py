@@ -0,0 +1,271 @@
+import collections
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import cv2
+import numpy as np
+
+INDEX_FILE = "index.jsonl"
+
+# File extension and the quality flag of each supported image format
+IMAGE_FORMATS = {
+    "png": (".png", cv2.IMWRITE_PNG_COMPRESSION),
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY)
+}
+
+
+def _to_json(value):
+    """json.dumps fallback for numpy scalars and arrays in incident fields"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class ImageEncoder:
+    """Encodes and writes report images on its own thread pool.
+
+    `quality` is the PNG compression level (0-9) for "png" and the 0-100
+    quality for "jpeg" and "webp" (above 100 is lossless WebP); None keeps
+    the OpenCV default. With `thumbnail` set, a copy scaled down to that
+    width is written next to every image. cv2.imencode releases the GIL,
+    so the encoding scales across cores. With `latency` (a LatencyStats)
+    every image is timed as "report.encode".
+    """
+
+    def __init__(self, format="png", quality=None, thumbnail=None, workers=None, latency=None):
+        if format not in IMAGE_FORMATS:
+            raise ValueError(f"Unknown image format '{format}', choose from {list(IMAGE_FORMATS)}")
+        self.format = format
+        self.extension, flag = IMAGE_FORMATS[format]
+        self.params = [flag, int(quality)] if quality is not None else []
+        self.thumbnail = thumbnail
+        self.latency = latency
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="encode")
+
+    def _write(self, path, image):
+        ok, data = cv2.imencode(self.extension, image, self.params)
+        if not ok:
+            raise ValueError(f"Could not encode {path}")
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def _encode(self, frame, directory, name):
+        if self.latency is None:
+            return self._encode_files(frame, directory, name)
+        with self.latency.stage("report.encode"):
+            return self._encode_files(frame, directory, name)
+
+    def _encode_files(self, frame, directory, name):
+        result = {"image": name + self.extension, "thumbnail": None}
+        self._write(os.path.join(directory, result["image"]), frame)
+        height, width = frame.shape[:2]
+        if self.thumbnail and width > self.thumbnail:
+            size = (self.thumbnail, max(round(height * self.thumbnail / width), 1))
+            result["thumbnail"] = name + "_thumb" + self.extension
+            self._write(os.path.join(directory, result["thumbnail"]),
+                        cv2.resize(frame, size, interpolation=cv2.INTER_AREA))
+        return result
+
+    def submit(self, frame, directory, name):
+        """Encode `frame` as <directory>/<name><ext> in the background.
+
+        The future's result holds the "image" and "thumbnail" file names.
+        """
+        return self._pool.submit(self._encode, frame, directory, name)
+
+    def close(self):
+        self._pool.shutdown()
+
+
+def _has_frames(incident):
+    return incident.get("frame") is not None or bool(incident.get("frames"))
+
+
+def read_index(report_dir):
+    """Incident records of a report directory, in the order they were written.
+
+    A line cut short by a crash is skipped.
+    """
+    records = []
+    path = os.path.join(report_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return records
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+
+class IncidentWriter:
+    """Streams incidents to a report directory from a background thread.
+
+    Every incident becomes an image incident_<n> plus one JSON line in
+    index.jsonl; events with several "frames" get incident_<n>_<name>.
+    Images are encoded in parallel by an ImageEncoder, which also picks the
+    format. Index lines are still written in order and only after their
+    images, and every line is flushed, so after a crash the index only
+    lists complete incidents. `progress(written, total)` is called after
+    each line, from the writer thread.
+
+    At most `queue_size` incidents with frames wait in memory. When that
+    many are queued the policy decides:
+
+    - "block": the caller waits until the writer catches up (backpressure)
+    - "drop_frame": the record goes to the index without its image
+    - "drop": the incident is not written at all
+
+    A failed image (encoding error, full disk) is logged and counted in
+    `failed_images`, its record goes to the index with "image" None; a
+    record that cannot be written is counted in `failed`. Either way the
+    writer keeps going and the queue slot is freed.
+    """
+
+    POLICIES = ("block", "drop_frame", "drop")
+
+    def __init__(self, report_dir, queue_size=32, policy="block", encoder=None, progress=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown policy '{policy}', choose from {self.POLICIES}")
+        self.report_dir = report_dir
+        self.policy = policy
+        self.written = 0
+        self.dropped = 0
+        self.frames_dropped = 0
+        self.failed = 0
+        self.failed_images = 0
+        self.queue_size = queue_size
+        self.encoder = encoder or ImageEncoder()
+        self.progress = progress
+        self._queue = queue.Queue()
+        self._space = threading.Condition()
+        self._frames = 0
+        self._count = 0
+        self._thread = None
+        self._index = None
+
+    def start(self):
+        os.makedirs(self.report_dir, exist_ok=True)
+        self._index = open(os.path.join(self.report_dir, INDEX_FILE), "a")
+        self._thread = threading.Thread(target=self._run, name="IncidentWriter", daemon=True)
+        self._thread.start()
+        return self
+
+    def write(self, incident):
+        """Queue one incident, returns False if the policy dropped it"""
+        with self._space:
+            if self.policy == "block":
+                self._space.wait_for(lambda: self._frames < self.queue_size)
+            if self._frames >= self.queue_size:
+                if self.policy == "drop":
+                    self.dropped += 1
+                    return False
+                # The small record still goes through, only the image is lost
+                self.frames_dropped += 1
+                incident = {key: value for key, value in incident.items()
+                            if key not in ("frame", "frames")}
+            if _has_frames(incident):
+                self._frames += 1
+            self._count += 1
+            self._queue.put((self._count, incident))
+        return True
+
+    def _run(self):
+        # Images of several incidents are encoded at once, their index lines
+        # follow in incident order as soon as the oldest one is done
+        pending = collections.deque()
+        while True:
+            while pending and all(future.done() for future in pending[0][2].values()):
+                self._finish(*pending.popleft())
+            if len(pending) > 2 * self.encoder.workers:
+                wait(pending[0][2].values())
+                continue
+            try:
+                item = self._queue.get(timeout=0.01 if pending else None)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            pending.append(self._submit(*item))
+        for item in pending:
+            wait(item[2].values())
+            self._finish(*item)
+
+    def _submit(self, number, incident):
+        record = {key: value for key, value in incident.items() if key not in ("frame", "frames")}
+        record["number"] = number
+        record["image"] = None
+        futures = {}
+        if incident.get("frame") is not None:
+            futures[None] = self.encoder.submit(incident["frame"], self.report_dir, f"incident_{number}")
+        seen = {}
+        for name, frame in (incident.get("frames") or {}).items():
+            if frame is None:
+                continue
+            # The same frame can be first, peak and last at once
+            if id(frame) not in seen:
+                seen[id(frame)] = self.encoder.submit(frame, self.report_dir, f"incident_{number}_{name}")
+            futures[name] = seen[id(frame)]
+        return record, _has_frames(incident), futures
+
+    def _finish(self, record, had_frames, futures):
+        try:
+            for name, future in futures.items():
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.failed_images += 1
+                    print(f"Could not save image of incident {record['number']}: {e}")
+                    result = {"image": None, "thumbnail": None}
+                if name is None:
+                    record.update(result)
+                else:
+                    record.setdefault("images", {})[name] = result["image"]
+                    record.setdefault("thumbnails", {})[name] = result["thumbnail"]
+            if "images" in record:
+                record["image"] = record["images"].get("peak")
+                record["thumbnail"] = record["thumbnails"].get("peak")
+            try:
+                self._index.write(json.dumps(record, default=_to_json) + "\n")
+                self._index.flush()
+            except (OSError, TypeError, ValueError) as e:
+                self.failed += 1
+                print(f"Could not write incident {record['number']} to the index: {e}")
+                return
+            self.written += 1
+        finally:
+            if had_frames:
+                with self._space:
+                    self._frames -= 1
+                    self._space.notify_all()
+        if self.progress is not None:
+            self.progress(self.written, self._count)
+
+    def stats(self):
+        return {
+            "written": self.written,
+            "dropped": self.dropped,
+            "frames_dropped": self.frames_dropped,
+            "failed": self.failed,
+            "failed_images": self.failed_images,
+            "queued": self._queue.qsize(),
+            "queued_frames": self._frames
+        }
+
+    def close(self):
+        """Write out everything still queued and close the index"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self.encoder.close()
+        os.fsync(self._index.fileno())
+        self._index.close()
@@ -0,0 +1,108 @@
+import time
+
+
+class DeadlineScheduler:
+    """Paces a loop on absolute deadlines from a monotonic nanosecond clock.
+
+    Frame k is due at t0 + k / fps, so processing time and sleep overshoot
+    never add up to drift the way `sleep(1/fps - process_time)` does, and
+    wall clock jumps do not matter. `wait()` sleeps until the next
+    deadline (spinning for the last `spin` seconds for accuracy). A frame
+    that starts more than `tolerance` periods after its deadline counts as
+    missed. If whole periods went by, the policy decides:
+
+    - "skip": the deadlines that passed are dropped (counted in `skipped`)
+      and the schedule continues from the current time slot
+    - "catch_up": the late frames run back to back until the schedule is
+      met again
+    """
+
+    POLICIES = ("skip", "catch_up")
+
+    def __init__(self, fps, policy="skip", tolerance=0.25, spin=0.0005):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown policy '{policy}', choose from {self.POLICIES}")
+        self.policy = policy
+        self.tolerance = tolerance
+        self.spin_ns = int(spin * 1e9)
+        self.fps = fps
+        self.period_ns = int(1e9 / fps)
+        self.frame = 0
+        self.missed = 0
+        self.skipped = 0
+        self.t0 = None
+
+    @staticmethod
+    def now():
+        """Current time of the scheduler clock in seconds"""
+        return time.perf_counter_ns() / 1e9
+
+    def start(self):
+        """Make frame 0 due now"""
+        self.t0 = time.perf_counter_ns()
+        self.frame = 0
+
+    def set_fps(self, fps):
+        """Change the rate, the schedule continues from the current deadline"""
+        if fps == self.fps:
+            return
+        if self.t0 is not None:
+            self.t0 += self.frame * self.period_ns
+            self.frame = 0
+        self.fps = fps
+        self.period_ns = int(1e9 / fps)
+
+    def wait(self):
+        """Block until the next frame is due and return its deadline in seconds"""
+        if self.t0 is None:
+            self.start()
+            return self.t0 / 1e9
+
+        self.frame += 1
+        deadline = self.t0 + self.frame * self.period_ns
+        now = time.perf_counter_ns()
+        if now < deadline:
+            if deadline - now > self.spin_ns:
+                time.sleep((deadline - now - self.spin_ns) / 1e9)
+            while time.perf_counter_ns() < deadline:
+                pass
+            return deadline / 1e9
+
+        return self._late(now, deadline) / 1e9
+
+    def next_deadline(self):
+        """Deadline of the next frame in seconds, without taking it (0.0 before the start)"""
+        if self.t0 is None:
+            return 0.0
+        return (self.t0 + (self.frame + 1) * self.period_ns) / 1e9
+
+    def poll(self):
+        """Take the next frame if it is due and return its deadline, else None.
+
+        The non-blocking wait() for callers that multiplex many schedules.
+        """
+        if self.t0 is None:
+            self.start()
+            return self.t0 / 1e9
+
+        deadline = self.t0 + (self.frame + 1) * self.period_ns
+        now = time.perf_counter_ns()
+        if now < deadline:
+            return None
+        self.frame += 1
+        return self._late(now, deadline) / 1e9
+
+    def _late(self, now, deadline):
+        """Count a late frame and apply the policy, returns the deadline to report"""
+        late = now - deadline
+        if late > self.tolerance * self.period_ns:
+            self.missed += 1
+        periods = late // self.period_ns
+        if periods and self.policy == "skip":
+            self.skipped += periods
+            self.frame += periods
+            deadline += periods * self.period_ns
+        return deadline
+
+    def stats(self):
+        return {"frames": self.frame, "missed": self.missed, "skipped": self.skipped}
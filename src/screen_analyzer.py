@@ -1,20 +1,63 @@
 import cv2
 import numpy as np
 import time
-import pyautogui
 import datetime
 import os
 
+# Only needed for interactive ROI selection, video files work without a display
+try:
+    import pyautogui
+except Exception:
+    pyautogui = None
+from frame_source import ScreenFrameSource, VideoFileFrameSource, open_frame_source
+from frame_buffer import FrameRingBuffer
+from engine import DetectionEngine
+from process_engine import ProcessPoolEngine
+from report_writer import IncidentWriter, ImageEncoder, read_index
+from events import EventAggregator
+from report_store import FrameMetrics, clock_anchor, write_manifest
+from clip_buffer import ClipRecorder
+from scheduler import DeadlineScheduler
+from histogram import summary_lines
+from profiler import draw_overlay, write_profile
+from multi_roi import MultiRegionEngine, bounding_box, check_regions
+
 class ScreenAnalyzer:
     def __init__(self, output_dir="reports"):
         self.fps_options = [15, 25, 30, 60]
         self.current_fps = 30
         self.x1, self.y1, self.x2, self.y2 = 0, 0, 0, 0
         self.roi_selected = False
+        self.source = None
+        self.video_path = None
+        self.frame_time = None
+        self.stats = {}
         self.running = False
-        self.frame_buffer = []
-        self.buffer_size = 3  # For frame comparison
-        self.report = []
+        self.frame_buffer = None
+        self.buffer_size = 3  # Frame history kept for comparison
+        self.workers = 0  # Detection processes, 0 runs detectors in this process
+        self.report_limit = 100  # Recent incidents kept in memory, all of them go to disk
+        # Runs of incidents are merged into events before they are written
+        self.engine = DetectionEngine(self.current_fps, report_limit=self.report_limit,
+                                      aggregator=EventAggregator())
+        self.report = self.engine.report
+        self.writer = None
+        self.report_dir = None
+        self.report_timestamp = None
+        self.image_format = "png"  # Report images: png, jpeg or webp
+        self.image_quality = None  # PNG compression level or JPEG/WebP quality
+        self.thumbnail_width = None  # Also write downscaled copies of this width
+        self.clip_seconds = None  # (before, after) seconds of video saved around incidents
+        self.clip_scale = 0.25  # Clip frames are kept and saved at this scale
+        self.schedule_policy = "skip"  # After a missed capture deadline: "skip" or "catch_up"
+        self.scheduler = None
+        self.profile_overlay = False  # Draw the costliest stages on the preview
+        self.duration = None  # Stop after this many seconds of the source
+        self.max_frames = None  # Stop after this many frames
+        self.verbose = True  # Print every incident as it is detected
+        self.regions = None  # Named ROIs analyzed instead of the whole capture, see set_regions
+        self.region_engine = None
+        self.interrupted = False
         self.output_dir = output_dir
         
         # Create output directory if it doesn't exist
@@ -35,172 +78,297 @@ class ScreenAnalyzer:
         self.x1, self.y1, w, h = roi
         self.x2, self.y2 = self.x1 + w, self.y1 + h
         self.roi_selected = True
+        self.source = ScreenFrameSource((self.x1, self.y1, self.x2, self.y2))
         print(f"ROI selected: ({self.x1}, {self.y1}) to ({self.x2}, {self.y2})")
     
     def set_fps(self, fps):
         """Set the capture framerate"""
         if fps in self.fps_options:
             self.current_fps = fps
+            self.engine.fps = fps
+            if self.scheduler is not None:
+                self.scheduler.set_fps(fps)
+            if self.region_engine is not None:
+                self.region_engine.set_fps(fps)
             print(f"FPS set to {fps}")
         else:
             print(f"Invalid FPS. Please choose from {self.fps_options}")
     
-    def capture_screen(self):
-        """Capture the selected region of screen"""
-        if not self.roi_selected:
-            print("Please select ROI first")
-            return None
+    def open_video(self, path):
+        """Analyze a recorded video file instead of the live screen"""
+        self.source = VideoFileFrameSource(path)
+        self.video_path = path
+        self.x1, self.y1 = 0, 0
+        self.x2, self.y2 = self.source.width, self.source.height
+        self.roi_selected = True
         
-        screenshot = pyautogui.screenshot(region=(self.x1, self.y1, 
-                                               self.x2 - self.x1, 
-                                               self.y2 - self.y1))
-        frame = np.array(screenshot)
-        return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        # Frame drops are measured against the container frame rate
+        if self.source.fps:
+            self.current_fps = self.source.fps
+            self.engine.fps = self.source.fps
+        self.engine.offline = True
+        print(f"Video opened: {path} ({self.source.width}x{self.source.height}, "
+              f"{self.current_fps:.2f} FPS, {self.source.frame_count} frames)")
     
-    def detect_green_pixels(self, frame):
-        """Detect green pixels in the frame"""
-        # Convert to HSV for better color detection
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        
-        # Define range of green color in HSV
-        lower_green = np.array([35, 100, 100])
-        upper_green = np.array([85, 255, 255])
-        
-        # Threshold the HSV image to get only green colors
-        mask = cv2.inRange(hsv, lower_green, upper_green)
-        
-        # Count green pixels
-        green_pixel_count = cv2.countNonZero(mask)
-        
-        # If green pixels exceed threshold
-        if green_pixel_count > 100:  # Adjust threshold as needed
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.report.append({
-                "timestamp": timestamp,
-                "type": "green_pixels",
-                "details": f"Detected {green_pixel_count} green pixels",
-                "frame": frame.copy()
-            })
-            print(f"Green pixels detected: {green_pixel_count}")
-            return True
-        return False
+    def open_source(self, source, region=None):
+        """Analyze "screen" (the `region` x1, y1, x2, y2), "synthetic[:pattern]" or a video file"""
+        if source != "screen" and not source.startswith("synthetic"):
+            if region is not None:
+                raise ValueError("Video files are not cropped, analyze part of them with set_regions")
+            self.open_video(source)
+            return
+        if region is None and source == "screen":
+            raise ValueError("Screen capture needs a region")
+        self.source = open_frame_source(source, region, self.current_fps)
+        self.video_path = None if source == "screen" else source
+        self.x1, self.y1 = region[:2] if region else (0, 0)
+        self.x2, self.y2 = self.x1 + self.source.width, self.y1 + self.source.height
+        self.roi_selected = True
+        self.engine.offline = not self.source.realtime
     
-    def detect_frame_drops(self):
-        """Detect frame drops by comparing timestamps"""
-        if len(self.frame_buffer) < 2:
-            return False
-            
-        expected_interval = 1.0 / self.current_fps
-        actual_interval = self.frame_buffer[-1]["time"] - self.frame_buffer[-2]["time"]
-        
-        # If actual interval is significantly larger than expected
-        if actual_interval > (expected_interval * 1.5):
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.report.append({
-                "timestamp": timestamp,
-                "type": "frame_drop",
-                "details": f"Expected: {expected_interval:.4f}s, Actual: {actual_interval:.4f}s",
-                "frame": self.frame_buffer[-1]["frame"]
-            })
-            print(f"Frame drop detected: {actual_interval:.4f}s vs expected {expected_interval:.4f}s")
-            return True
-        return False
+    def set_regions(self, regions):
+        """Analyze several named ROIs, each with its own detectors and thresholds.
+
+        `regions` maps a name to {"roi": (x1, y1, x2, y2), "detectors": [...],
+        "thresholds": {...}} as taken by MultiRegionEngine. For the screen
+        only the bounding box of the ROIs is grabbed; for an opened video
+        the ROIs are in frame coordinates. Raises ValueError for regions
+        outside that frame or with unknown detectors and thresholds.
+        """
+        if self.video_path is None:
+            check_regions(regions)
+        else:
+            check_regions(regions, self.source.width, self.source.height)
+        self.regions = regions
+        if self.video_path is None:
+            x1, y1, x2, y2 = bounding_box(regions)
+            self.source = ScreenFrameSource((x1, y1, x2, y2))
+            self.x1, self.y1, self.x2, self.y2 = x1, y1, x2, y2
+            self.roi_selected = True
     
-    def detect_image_tearing(self, frame):
-        """Detect image tearing/artifacts"""
-        if len(self.frame_buffer) < 2:
-            return False
-            
-        prev_frame = self.frame_buffer[-1]["frame"]
-        
-        # Convert to grayscale
-        gray1 = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        # Calculate absolute difference
-        diff = cv2.absdiff(gray1, gray2)
-        
-        # Threshold the difference
-        _, thresh = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
-        
-        # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # If large contours found, might indicate tearing
-        large_contours = [c for c in contours if cv2.contourArea(c) > 500]
+    def analyzed_engines(self):
+        """(region name, engine, report directory) of everything analyzed, name None without regions"""
+        if self.region_engine is None:
+            return [(None, self.engine, self.report_dir)]
+        return [(name, engine, os.path.join(self.report_dir, name))
+                for name, engine in self.region_engine.engines.items()]
+    
+    def capture_frame(self):
+        """Read the next frame and its timestamp from the current source"""
+        if not self.roi_selected:
+            print("Please select ROI first")
+            return None, None
         
-        if len(large_contours) > 0:
-            # Draw contours on frame copy
-            frame_with_contours = frame.copy()
-            cv2.drawContours(frame_with_contours, large_contours, -1, (0, 0, 255), 2)
-            
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.report.append({
-                "timestamp": timestamp,
-                "type": "image_tearing",
-                "details": f"Detected {len(large_contours)} potential tears",
-                "frame": frame_with_contours
-            })
-            print(f"Image tearing detected: {len(large_contours)} regions")
-            return True
-        return False
+        # The source reuses its buffer, callers copy what they keep
+        return self.source.read()
     
-    def start_analysis(self):
-        """Start analyzing the screen region"""
+    def capture_screen(self):
+        """Capture the selected region of screen"""
+        frame, _ = self.capture_frame()
+        return frame
+    
+    def start_analysis(self, show_preview=True):
+        """Start analyzing the screen region or the opened video file"""
         if not self.roi_selected:
             print("Please select ROI first")
             return
             
         self.running = True
-        self.frame_buffer = []
-        self.report = []
+        self.interrupted = False
+        
+        # Incidents are written to the report directory while the analysis runs
+        self.report_timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.report_dir = os.path.join(self.output_dir, f"report_{self.report_timestamp}")
+        self.region_engine = None
+        if self.regions:
+            # One grab, every region analyzed on its own view of it
+            self.region_engine = MultiRegionEngine(self.regions, self.current_fps, offline=self.engine.offline,
+                                                   report_limit=self.report_limit, latency=self.engine.latency)
+        self.engine.reset()
+        for name, engine, report_dir in self.analyzed_engines():
+            encoder = ImageEncoder(self.image_format, self.image_quality, self.thumbnail_width,
+                                   latency=self.engine.latency)
+            engine.writer = IncidentWriter(report_dir, encoder=encoder,
+                                           policy="drop_frame" if self.source.realtime else "block").start()
+            engine.metrics = FrameMetrics(report_dir, [d.name for d in engine.detectors])
+            engine.report_limit = self.report_limit
+            engine.reset()
+        self.writer = self.engine.writer
+        # Live frame times are perf_counter seconds, the anchor maps them to
+        # the wall clock. Written now too, so a crashed run keeps it
+        clock = clock_anchor() if self.source.realtime else None
+        started = dict(started=self.report_timestamp, source=self.video_path or "screen", clock=clock)
+        for name, engine, report_dir in self.analyzed_engines():
+            write_manifest(report_dir, complete=False, **started)
+        if self.region_engine is not None:
+            write_manifest(self.report_dir, complete=False, regions=list(self.region_engine.engines),
+                           **started)
+        clips = None
+        if self.clip_seconds:
+            clips = ClipRecorder(self.report_dir, self.current_fps, *self.clip_seconds,
+                                 scale=self.clip_scale)
+        pool = None
+        if self.workers and self.region_engine is not None:
+            # Regions keep the in-process ring below, only the pool is skipped
+            print("Regions are analyzed on threads, the process pool is not used")
+        elif self.workers:
+            # Frames go to shared memory, detectors run in a process pool
+            pool = ProcessPoolEngine(self.engine, self.source.height, self.source.width,
+                                     workers=self.workers)
+            self.frame_buffer = pool.ring
+        if pool is None:
+            self.frame_buffer = FrameRingBuffer(self.buffer_size, self.source.height, self.source.width)
+            self.frame_buffer.latency = self.engine.latency
+            if self.region_engine is not None:
+                self.region_engine.attach(self.frame_buffer, (self.x1, self.y1))
+        self.source.latency = self.engine.latency
+        self.report = self.engine.report
         
-        print(f"Starting analysis at {self.current_fps} FPS...")
+        # Offline sources are not paced, they run as fast as detection allows.
+        # Live capture starts on absolute deadlines, see DeadlineScheduler
+        paced = self.source.realtime
+        self.scheduler = DeadlineScheduler(self.current_fps, self.schedule_policy)
+        frames_analyzed = 0
+        gap = False
+        self.frame_time = None
+        first_time = None
+        analysis_start = time.perf_counter()
+        last_progress = analysis_start
+        last_overlay = analysis_start - 1.0
+        overlay = {}
+        
+        if paced:
+            print(f"Starting analysis at {self.current_fps} FPS...")
+        else:
+            print(f"Starting offline analysis of {self.video_path}...")
         
         try:
             while self.running:
-                loop_start = time.time()
+                if self.max_frames is not None and frames_analyzed >= self.max_frames:
+                    break
+                if paced:
+                    skipped = self.scheduler.skipped
+                    self.scheduler.wait()
+                    # Deadlines dropped because analysis fell behind are not
+                    # frame drops of the source
+                    gap = gap or self.scheduler.skipped != skipped
+                loop_start = time.perf_counter()
                 
-                # Capture frame
-                frame = self.capture_screen()
-                if frame is None:
+                # Capture straight into the next history slot, the timestamp
+                # is the container PTS for video files
+                with self.engine.latency.stage("capture"):
+                    if pool:
+                        index = pool.capture(self.source, gap=gap)
+                    else:
+                        index = self.frame_buffer.capture(self.source, gap=gap)
+                if index is None:
+                    if not paced:
+                        break
                     continue
-                
-                # Store in buffer with timestamp
-                self.frame_buffer.append({
-                    "frame": frame,
-                    "time": time.time()
-                })
-                
-                # Keep buffer size limited
-                if len(self.frame_buffer) > self.buffer_size:
-                    self.frame_buffer.pop(0)
+                gap = False
+                frame = self.frame_buffer.frame(index)
+                if first_time is None:
+                    first_time = self.frame_buffer.time(index)
+                elif self.duration is not None and self.frame_buffer.time(index) - first_time >= self.duration:
+                    break
+                if self.frame_time is not None:
+                    self.engine.latency.record("interval", self.frame_buffer.time(index) - self.frame_time)
+                self.frame_time = self.frame_buffer.time(index)
                 
                 # Run detections
-                self.detect_green_pixels(frame)
-                self.detect_frame_drops()
-                self.detect_image_tearing(frame)
-                
-                # Display the frame
-                cv2.imshow("Screen Analysis", frame)
-                
-                # Check for exit
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+                if pool:
+                    found = [(None, incident) for incident in pool.process(index)]
+                elif self.region_engine is not None:
+                    found = self.region_engine.process(index)
+                else:
+                    incidents = self.engine.process(self.frame_buffer.context(index))
+                    found = [(None, incident) for incident in incidents]
+                if clips:
+                    clips.add(index, self.frame_time, frame)
+                for region, incident in found:
+                    if self.verbose:
+                        prefix = f"[{region}] " if region else ""
+                        print(f"{prefix}{incident['label']} detected: {incident['details']}")
+                    if clips:
+                        clips.trigger(incident)
+                frames_analyzed += 1
                 
-                # Calculate sleep time to maintain FPS
-                process_time = time.time() - loop_start
-                sleep_time = (1.0 / self.current_fps) - process_time
+                if show_preview:
+                    with self.engine.latency.stage("preview"):
+                        # Display the frame, timings go on a copy, the buffer is still in use
+                        if self.profile_overlay:
+                            if loop_start - last_overlay >= 0.5:
+                                last_overlay = loop_start
+                                overlay = self.engine.latency.summary()
+                            frame = draw_overlay(frame.copy(), overlay)
+                        cv2.imshow("Screen Analysis", frame)
+                        
+                        # Check for exit
+                        key = cv2.waitKey(1) & 0xFF
+                    if key == ord('q'):
+                        break
                 
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
+                if not paced:
+                    if loop_start - last_progress >= 5.0:
+                        last_progress = loop_start
+                        self.update_stats(frames_analyzed, loop_start - analysis_start)
+                        print(f"Analyzed {frames_analyzed} frames ({self.stats['fps']:.1f} FPS, "
+                              f"{self.stats['realtime_factor']:.1f}x real-time)")
                 
         except KeyboardInterrupt:
-            pass
+            self.interrupted = True
         finally:
-            cv2.destroyAllWindows()
+            if show_preview:
+                cv2.destroyAllWindows()
             self.running = False
+            self.source.close()
+            if pool:
+                for incident in pool.flush():
+                    if self.verbose:
+                        print(f"{incident['label']} detected: {incident['details']}")
+                    if clips:
+                        clips.trigger(incident)
+                pool.close()
+                self.frame_buffer = None
+            for name, engine, report_dir in self.analyzed_engines():
+                engine.finish()
+                engine.writer.close()
+                engine.metrics.close()
+            if self.region_engine is not None:
+                self.region_engine.close()
+            if clips:
+                clips.close()
+            self.update_stats(frames_analyzed, time.perf_counter() - analysis_start)
+            print(f"Analyzed {frames_analyzed} frames in {self.stats['elapsed']:.2f}s "
+                  f"({self.stats['fps']:.1f} FPS, {self.stats['realtime_factor']:.1f}x real-time)")
+            if paced:
+                print(f"Missed capture deadlines: {self.scheduler.missed} "
+                      f"({self.scheduler.skipped} frames skipped)")
+            for line in summary_lines(self.engine.latency.summary()):
+                print(line)
+            path = write_profile(self.report_dir, self.engine.latency.summary(), self.stats["elapsed"])
+            print(f"Timing breakdown saved to {path}")
             self.save_report()
+            info = dict(started, fps=self.current_fps, clips=clips.written if clips else 0,
+                        latency=self.engine.latency.summary())
+            for name, engine, report_dir in self.analyzed_engines():
+                roi = self.region_engine.rois[name] if name else (self.x1, self.y1, self.x2, self.y2)
+                write_manifest(report_dir, roi=roi, frames=engine.metrics.frames,
+                               events=engine.event_count, **info)
+            if self.region_engine is not None:
+                # The session manifest only points at the region reports
+                write_manifest(self.report_dir, roi=(self.x1, self.y1, self.x2, self.y2),
+                               frames=frames_analyzed, regions=list(self.region_engine.engines), **info)
+    
+    def update_stats(self, frames, elapsed):
+        """Update analysis throughput statistics"""
+        fps = frames / elapsed if elapsed > 0 else 0.0
+        self.stats = {
+            "frames": frames,
+            "elapsed": elapsed,
+            "fps": fps,
+            "realtime_factor": fps / self.current_fps if self.current_fps else 0.0
+        }
     
     def stop_analysis(self):
         """Stop the analysis"""
@@ -208,28 +376,59 @@ class ScreenAnalyzer:
         print("Analysis stopped")
     
     def save_report(self):
-        """Save the report to a file"""
-        if not self.report:
+        """Write the summary next to the incidents streamed during the analysis"""
+        if not self.report_dir:
+            print("No issues to report")
+            return
+        sections = [(name, engine, read_index(report_dir))
+                    for name, engine, report_dir in self.analyzed_engines()]
+        if not any(records for _, _, records in sections):
             print("No issues to report")
             return
-            
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        report_dir = os.path.join(self.output_dir, f"report_{timestamp}")
-        os.makedirs(report_dir, exist_ok=True)
         
         # Write summary text file
-        with open(os.path.join(report_dir, "summary.txt"), "w") as f:
-            f.write(f"Screen Analysis Report - {timestamp}\n")
+        with open(os.path.join(self.report_dir, "summary.txt"), "w") as f:
+            f.write(f"Screen Analysis Report - {self.report_timestamp}\n")
             f.write(f"FPS: {self.current_fps}\n")
-            f.write(f"ROI: ({self.x1}, {self.y1}) to ({self.x2}, {self.y2})\n\n")
+            if self.video_path is not None:
+                f.write(f"Source: {self.video_path}\n")
+            f.write(f"ROI: ({self.x1}, {self.y1}) to ({self.x2}, {self.y2})\n")
+            if self.stats:
+                f.write(f"Analyzed: {self.stats['frames']} frames in {self.stats['elapsed']:.2f}s "
+                        f"({self.stats['fps']:.1f} FPS, {self.stats['realtime_factor']:.1f}x real-time)\n")
+            if self.source.realtime and self.scheduler is not None:
+                f.write(f"Missed capture deadlines: {self.scheduler.missed} "
+                        f"({self.scheduler.skipped} frames skipped)\n")
+            dropped = sum(engine.writer.stats()["dropped"] for _, engine, _ in sections)
+            frames_dropped = sum(engine.writer.stats()["frames_dropped"] for _, engine, _ in sections)
+            failed = sum(engine.writer.stats()["failed"] for _, engine, _ in sections)
+            failed_images = sum(engine.writer.stats()["failed_images"] for _, engine, _ in sections)
+            if dropped or frames_dropped:
+                f.write(f"Not saved: {dropped} incidents, {frames_dropped} incident images\n")
+            if failed or failed_images:
+                f.write(f"Failed to save: {failed} incidents, {failed_images} incident images\n")
+            f.write("\nLatency:\n")
+            for line in summary_lines(self.engine.latency.summary()):
+                f.write(f"{line}\n")
+            f.write("\n")
             
-            for i, incident in enumerate(self.report):
-                f.write(f"Incident #{i+1}\n")
-                f.write(f"Timestamp: {incident['timestamp']}\n")
-                f.write(f"Type: {incident['type']}\n")
-                f.write(f"Details: {incident['details']}\n\n")
-                
-                # Save frame
-                cv2.imwrite(os.path.join(report_dir, f"incident_{i+1}.png"), incident["frame"])
+            for name, engine, records in sections:
+                # Region reports live in their own subdirectories
+                folder = ""
+                if name is not None:
+                    x1, y1, x2, y2 = self.region_engine.rois[name]
+                    f.write(f"Region: {name} ({x1}, {y1}) to ({x2}, {y2}), {len(records)} events\n\n")
+                    folder = name + "/"
+                for record in records:
+                    f.write(f"Event #{record['number']}\n")
+                    f.write(f"Timestamp: {record['timestamp']}\n")
+                    f.write(f"Type: {record['type']}\n")
+                    f.write(f"Details: {record['details']}\n")
+                    if record.get("images"):
+                        images = sorted(set(record['images'].values()))
+                        f.write(f"Images: {', '.join(folder + image for image in images)}\n")
+                    elif record["image"]:
+                        f.write(f"Image: {folder}{record['image']}\n")
+                    f.write("\n")
         
-        print(f"Report saved to {report_dir}")
\ No newline at end of file
+        print(f"Report saved to {self.report_dir}")
@@ -1,9 +1,11 @@
 import cv2
-import numpy as np
-import time
 import pyautogui
 import datetime
 import os
+from frame_source import ScreenFrameSource
+from frame_buffer import FrameRingBuffer
+from engine import DetectionEngine
+from scheduler import DeadlineScheduler
 
 def main():
     # Создаем директорию для отчетов
@@ -24,112 +26,48 @@ def main():
     x1, y1, w, h = 0, 0, 1280, 720
     print(f"Using region: ({x1}, {y1}) to ({x1+w}, {y1+h})")
     
-    # Буфер для обнаружения выпадения кадров
-    frame_buffer = []
-    buffer_size = 3
-    report = []
+    # Кольцевой буфер кадров и общий движок детекторов
+    source = ScreenFrameSource((x1, y1, x1 + w, y1 + h))
+    frame_buffer = FrameRingBuffer(3, h, w)
+    engine = DetectionEngine(fps)
+    report = engine.report
+    scheduler = DeadlineScheduler(fps)
     running = True
     
     try:
         print("Starting analysis... Press Ctrl+C to stop")
         
         while running:
-            loop_start = time.time()
+            # Кадр k захватывается в момент t0 + k/fps, без накопления дрейфа
+            skipped = scheduler.skipped
+            scheduler.wait()
             
-            # Захват экрана
-            screenshot = pyautogui.screenshot(region=(x1, y1, w, h))
-            frame = np.array(screenshot)
-            frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            # Захват экрана прямо в следующую ячейку буфера; пропущенные
+            # сроки захвата - разрыв истории, а не выпадение кадров источника
+            index = frame_buffer.capture(source, gap=scheduler.skipped != skipped)
+            frame = frame_buffer.frame(index)
             
-            # Добавляем в буфер с отметкой времени
-            current_time = time.time()
-            frame_buffer.append({
-                "frame": frame.copy(),
-                "time": current_time
-            })
+            # Обнаружение дефектных цветов, выпадения кадров и разрывов
+            for incident in engine.process(frame_buffer.context(index)):
+                print(f"{incident['label']} detected: {incident['details']}")
             
-            # Ограничиваем размер буфера
-            if len(frame_buffer) > buffer_size:
-                frame_buffer.pop(0)
-            
-            # 1. Обнаружение зеленых пикселей
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-            lower_green = np.array([35, 100, 100])
-            upper_green = np.array([85, 255, 255])
-            mask = cv2.inRange(hsv, lower_green, upper_green)
-            green_pixel_count = cv2.countNonZero(mask)
-            
-            if green_pixel_count > 100:  # Порог срабатывания
-                timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                report.append({
-                    "timestamp": timestamp,
-                    "type": "green_pixels",
-                    "details": f"Detected {green_pixel_count} green pixels",
-                    "frame": frame.copy()
-                })
-                print(f"Green pixels detected: {green_pixel_count}")
-            
-            # 2. Обнаружение выпадения кадров
-            if len(frame_buffer) >= 2:
-                expected_interval = 1.0 / fps
-                actual_interval = frame_buffer[-1]["time"] - frame_buffer[-2]["time"]
-                
-                if actual_interval > (expected_interval * 1.5):
-                    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    report.append({
-                        "timestamp": timestamp,
-                        "type": "frame_drop",
-                        "details": f"Expected: {expected_interval:.4f}s, Actual: {actual_interval:.4f}s",
-                        "frame": frame.copy()
-                    })
-                    print(f"Frame drop detected: {actual_interval:.4f}s vs expected {expected_interval:.4f}s")
-            
-            # 3. Обнаружение разрывов изображения
-            if len(frame_buffer) >= 2:
-                prev_frame = frame_buffer[-2]["frame"]
-                gray1 = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-                gray2 = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                
-                diff = cv2.absdiff(gray1, gray2)
-                _, thresh = cv2.threshold(diff, 30, 255, cv2.THRESH_BINARY)
-                
-                contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                large_contours = [c for c in contours if cv2.contourArea(c) > 500]
-                
-                if len(large_contours) > 0:
-                    frame_with_contours = frame.copy()
-                    cv2.drawContours(frame_with_contours, large_contours, -1, (0, 0, 255), 2)
-                    
-                    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    report.append({
-                        "timestamp": timestamp,
-                        "type": "image_tearing",
-                        "details": f"Detected {len(large_contours)} potential tears",
-                        "frame": frame_with_contours
-                    })
-                    print(f"Image tearing detected: {len(large_contours)} regions")
-            
-            # Показываем кадр
+            # Показываем кадр (рисуем на копии, буфер нужен для сравнения)
+            display = frame.copy()
             text = f"FPS: {fps} | Press 'q' to quit"
-            cv2.putText(frame, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-            cv2.imshow("Screen Analysis", frame)
+            cv2.putText(display, text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+            cv2.imshow("Screen Analysis", display)
             
             # Проверяем нажатие клавиши выхода
             key = cv2.waitKey(1) & 0xFF
             if key == ord('q'):
                 break
-            
-            # Поддержание FPS
-            process_time = time.time() - loop_start
-            sleep_time = (1.0 / fps) - process_time
-            
-            if sleep_time > 0:
-                time.sleep(sleep_time)
     
     except KeyboardInterrupt:
         print("\nAnalysis stopped by user")
     finally:
         cv2.destroyAllWindows()
+        source.close()
+        print(f"Missed capture deadlines: {scheduler.missed}")
         
         # Сохраняем отчет
         if report: